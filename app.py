@@ -1,11 +1,22 @@
+import json
+import os
+import tempfile
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output
+from dash.exceptions import PreventUpdate
 from pathlib import Path
 
+from figure_cache import DiskBackend, FigureCache, MemoryBackend
 from plots_layout import *
+from profiling import metrics, profiled
+from refresher import Refresher
+from reporters import REPORTER_NAMES, ReporterRegistry, reporter_name
+from trade_store import build_store
+from utilities import logs
 
 app = dash.Dash(__name__)
 
@@ -14,16 +25,7 @@ app.title = 'Share Trade Flows'
 #for heroku to run correctly
 server = app.server
 
-input_path = Path('data/')
-
-mex_imp_df = pd.read_csv(input_path / f'mex_import.csv')
-mex_exp_df = pd.read_csv(input_path / f'mex_export.csv')
-kor_imp_df = pd.read_csv(input_path / f'kor_import.csv')
-kor_exp_df = pd.read_csv(input_path / f'kor_export.csv')
-mex_imp_df = mex_imp_df[mex_imp_df['origin_name'] != 'EU27']
-mex_exp_df = mex_exp_df[mex_exp_df['destination_name'] != 'EU27']
-kor_imp_df = kor_imp_df[kor_imp_df['origin_name'] != 'EU27']
-kor_exp_df = kor_exp_df[kor_exp_df['destination_name'] != 'EU27']
+input_path = Path(os.environ.get('DATA_PATH', 'data/'))
 
 dict_industries = {"Agri_Food": [1, 24], "Mineral products": [25, 27], "Chemical": [28, 38],
                    "Plastic/Rubbers": [39, 40], "Raw Hide": [41, 43], "Wood Products": [44, 49],
@@ -31,7 +33,90 @@ dict_industries = {"Agri_Food": [1, 24], "Mineral products": [25, 27], "Chemical
                    "Machinery/Elec. Equip": [84, 85], "Vehicle": [86, 89], "Optical/Photo. Instr.": [90, 92],
                    "Other": [93, 99], "Total": [101, 102]}
 
+def build_share_store():
+    """Build the columnar store of the share files that are new or changed (input_path / "store"), which every worker
+    maps instead of reading the CSV files. Workers starting together build each dataset once; when the data folder
+    is read-only the datasets are read from the CSV files."""
+    try:
+        build_store(input_path)
+    except OSError:
+        logs('trade_store', 'trade_store').exception(f"cannot build the store in {input_path}")
+
+build_share_store()
+
+# Reporters are found from the share files in input_path and in its store;
+# their data and rankings are loaded on first request and dropped past REPORTER_MEMORY_MB
+registry = ReporterRegistry(input_path, dict_industries.keys(), memory_budget = int(os.environ.get('REPORTER_MEMORY_MB', '256')) * 2**20)
+default_reporters = [reporter for reporter in ['kor', 'mex'] if reporter in registry.reporters] or registry.reporters[:2]
+
+# Every REFRESH_INTERVAL seconds (0 to disable) the store is brought up to date with the share files and the reporters
+# whose files were rewritten, e.g. by refresher.py, are reloaded in the background and swapped in once ready. The thread
+# runs in the process that imports the app, so with gunicorn --preload every worker only starts serving from the data
+# loaded before the fork.
+def refresh_reporters():
+    build_share_store()
+    return registry.refresh()
+
+refresh_interval = float(os.environ.get('REFRESH_INTERVAL', '60'))
+refresher = Refresher(refresh_interval, refresh_reporters, name = 'reporters_refresh')
+if refresh_interval > 0:
+    refresher.start()
+
+# Figures are cached in a SQLite file shared by all the workers (FIGURE_CACHE_PATH, "" keeps them in memory),
+# up to FIGURE_CACHE_MB of JSON
+cache_path = os.environ.get('FIGURE_CACHE_PATH', str(Path(tempfile.gettempdir()) / 'plots_roo_figures.sqlite'))
+cache_bytes = int(os.environ.get('FIGURE_CACHE_MB', '64')) * 2**20
+figure_cache = FigureCache(DiskBackend(cache_path, cache_bytes) if cache_path else MemoryBackend(cache_bytes))
+
+@profiled('build_figure')
+def build_figure(industry, top, reporters):
+    frames, index = registry.select(reporters)
+    return layout_share(frames, industry, top, list(reporters), index = index, names = REPORTER_NAMES)
+
+@profiled('build_series')
+def build_series(industry, reporters):
+    frames, index = registry.select(reporters)
+    return share_series(frames, industry, list(reporters), index = index, names = REPORTER_NAMES)
+
+def normalize_inputs(top, industry, reporters):
+    """Return the (industry, top, reporters) cache key of the callback inputs; invalid inputs leave the chart as it is.
+    Any top value above the largest ranking of the selected reporters gives the same figure, so it is capped there."""
+    if top is None or industry not in dict_industries or not reporters or not set(reporters) <= set(registry.reporters):
+        raise PreventUpdate
+    # Partners without a share in the ranking year have a NaN ranking
+    ranks = [entry['ranks'][~np.isnan(entry['ranks'])] for reporter in reporters
+             for (flow, ind), entry in registry.get(reporter)['index'].items() if ind == industry]
+    max_ranking = max([1] + [ranking.max() for ranking in ranks if len(ranking)])
+    return industry, min(max(1, int(top)), int(max_ranking)), tuple(reporters)
+
+def data_version(reporters):
+    """Return the version of the datasets loaded for the reporters, which changes when refresh swaps in new ones."""
+    return '|'.join(f"{reporter}:{registry.get(reporter)['version']}" for reporter in reporters)
+
+# SERVING_MODE=server builds every figure in a callback, so each change of the ranking is a request. With
+# SERVING_MODE=client the server only sends the ranked series of the industry and reporters once (share_series)
+# and the figure of any top is drawn in the browser by assets/share_clientside.js
+serving_mode = os.environ.get('SERVING_MODE', 'server')
+
+# FIGURE_CACHE_WARM=n builds what the serving mode sends for the default reporters: the figures for the top 1 to n
+# of every industry, or in client mode the series of every industry
+warm_top = int(os.environ.get('FIGURE_CACHE_WARM', '0'))
+if default_reporters and warm_top > 0:
+    if serving_mode == 'client':
+        figure_cache.warm([(industry, tuple(default_reporters)) for industry in dict_industries], build_series, version = data_version(default_reporters))
+    else:
+        figure_cache.warm([(industry, top, tuple(default_reporters)) for industry in dict_industries for top in range(1, warm_top + 1)],
+                          build_figure, version = data_version(default_reporters))
+
 app.layout = html.Div([
+    dcc.Dropdown(
+        id="reporter-dropdown",
+        options=[{"label": reporter_name(x), "value": x}
+                 for x in registry.reporters],
+        value = default_reporters,
+        multi = True,
+        placeholder="Select the reporters",
+    ),
     dcc.Dropdown(
         id="product-dropdown",
         options=[{"label": x, "value": x} 
@@ -46,15 +131,42 @@ app.layout = html.Div([
     ],
     ),
     dcc.Graph(id="line-chart"),
-])
-
-@app.callback(
-    Output("line-chart", "figure"), 
-    [Input("styled-numeric-input", "value"),
-    Input("product-dropdown", "value")])
-def update_line_chart(top, industry):
-    fig = layout_share(mex_imp_df, mex_exp_df, kor_imp_df, kor_exp_df, industry, top)
-    return fig
+] + ([dcc.Store(id="share-data")] if serving_mode == 'client' else []))
+
+if serving_mode == 'client':
+    @app.callback(
+        Output("share-data", "data"),
+        [Input("product-dropdown", "value"),
+        Input("reporter-dropdown", "value")])
+    @profiled('callback.update_share_data')
+    def update_share_data(industry, reporters):
+        industry, _, reporters = normalize_inputs(1, industry, reporters)
+        return json.loads(figure_cache.get_or_build((industry, reporters), build_series, version = data_version(reporters)))
+
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'share', function_name = 'top_figure'),
+        Output("line-chart", "figure"),
+        [Input("share-data", "data"),
+        Input("styled-numeric-input", "value")])
+else:
+    @app.callback(
+        Output("line-chart", "figure"), 
+        [Input("styled-numeric-input", "value"),
+        Input("product-dropdown", "value"),
+        Input("reporter-dropdown", "value")])
+    @profiled('callback.update_line_chart')
+    def update_line_chart(top, industry, reporters):
+        inputs = normalize_inputs(top, industry, reporters)
+        return json.loads(figure_cache.get_or_build(inputs, build_figure, version = data_version(reporters)))
+
+@server.route('/cache-stats')
+def cache_stats():
+    return dict(figure_cache.stats(), pid = os.getpid(), shared = isinstance(figure_cache.backend, DiskBackend))
+
+# Timing of the callbacks and of the figure builds of this worker (PROFILE_METRICS_PATH collects all the workers)
+@server.route('/metrics')
+def stage_metrics():
+    return {'pid': os.getpid(), 'stages': metrics.summary(), 'figure_cache': figure_cache.stats(), 'refresh': refresher.status}
 
 if __name__ == '__main__':
    app.run_server(debug=True)
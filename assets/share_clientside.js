@@ -0,0 +1,54 @@
+// Clientside callbacks of app.py in the "client" serving mode (SERVING_MODE=client).
+// share.top_figure draws the figure of layout_share from the compact data of plots_layout.share_series,
+// so changing the ranking only runs in the browser.
+
+// Python's "{:,.2f}"; one formatter for all the points, toLocaleString builds a new one per call
+var numberFormat = new Intl.NumberFormat('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+
+function formatNumber(value) {
+    return numberFormat.format(value);
+}
+
+function topFigure(data, top) {
+    // Same top as normalize_inputs on the server: max(1, int(top))
+    top = Math.max(1, Math.trunc(top));
+    var traces = [];
+    data.panels.forEach(function(panel) {
+        // Partners are sorted by ranking: keep the ones ranked top or better, as top_partners does.
+        // A missing ranking arrives as null, and null <= top is true
+        var count = 0;
+        while (count < panel.ranks.length && panel.ranks[count] !== null && panel.ranks[count] <= top) {
+            count++;
+        }
+        for (var i = 0; i < count; i++) {
+            var start = panel.offsets[i], end = panel.offsets[i + 1];
+            var x = panel.year.slice(start, end), y = panel.share.slice(start, end), ranking = panel.ranking.slice(start, end);
+            var country = panel.partners[i];
+            traces.push({
+                type: 'scatter', mode: 'lines+markers', name: country, xaxis: panel.xaxis, yaxis: panel.yaxis, x: x, y: y,
+                hoverinfo: 'text',
+                hovertext: x.map(function(year, j) {
+                    return 'Year: ' + year + ' <br>Country: ' + country + ' <br>Share: ' + formatNumber(y[j]) + ' <br>Ranking: ' + formatNumber(ranking[j]);
+                })
+            });
+        }
+    });
+    return {data: traces, layout: data.layout};
+}
+
+if (typeof window !== 'undefined') {
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        share: {
+            top_figure: function(data, top) {
+                if (!data || top === null || top === undefined) {
+                    return window.dash_clientside.no_update;
+                }
+                return topFigure(data, top);
+            }
+        }
+    });
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = {topFigure: topFigure};
+}
@@ -0,0 +1,1040 @@
+"""Benchmarks for the BACI cleaning steps and the plotting layer.
+
+The pipeline benchmarks work on synthetic data, so they run without a local copy of BACI;
+the serving benchmarks use the share files in data/.
+The suite runs the BACI stages and the figure builders at several scales and fails when a case
+regresses past a threshold of the baseline stored in benchmark_baseline.json.
+Usage: python benchmarks.py <benchmark> [--rows N]
+       python benchmarks.py suite [--scales small medium] [--save] [--threshold 1.75] [--memory]
+       python benchmarks.py serving [--sessions 200] [--threads 4]
+"""
+import argparse
+import inspect
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from class_data import *
+from tests.legacy import legacy_aggregate_country, legacy_layout_share, legacy_total_flow
+
+
+def timed(func, *args, **kwargs):
+    """Run func once and return its result together with the elapsed wall-clock seconds."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def traced(func, *args, **kwargs):
+    """Run func once under tracemalloc and return its result, the elapsed seconds and the peak of traced memory in MB."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        result, seconds = timed(func, *args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def memory_usage():
+    """Return the resident and private memory of the current process in MB (Linux only).
+    Private memory excludes the file-backed pages shared with other processes."""
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('Rss', 'Private_Clean', 'Private_Dirty'):
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return {'rss': float('nan'), 'private': float('nan')}
+    return {'rss': usage['Rss'], 'private': usage['Private_Clean'] + usage['Private_Dirty']}
+
+
+def run_isolated(script, env = None):
+    """Run a python script in a fresh interpreter, with extra environment variables, and return the JSON object it prints last."""
+    import os
+    process = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True, env = dict(os.environ, **(env or {})))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+REPORTERS = ['kor', 'mex']
+
+
+def load_shares(csv = False):
+    """Load the four share datasets served by the app, in the argument order of legacy_layout_share: from the store,
+    or with csv=True from the share files as the app read them before the store, to check the store against."""
+    from trade_store import drop_excluded, load_dataset
+    names = ['mex_import', 'mex_export', 'kor_import', 'kor_export']
+    if csv:
+        return {name: drop_excluded(pd.read_csv(Path('data/') / f'{name}.csv')) for name in names}
+    return {name: load_dataset(name, Path('data/')) for name in names}
+
+
+def same_traces(fig, other):
+    """Return True when two figures hold the same traces in the same order (which sets their colours and legend order),
+    whatever the dtypes of their arrays (the store has int16 years). The layout is not compared: the subplot titles of
+    legacy_layout_share had typos."""
+    return list(map(trace_values, fig.data)) == list(map(trace_values, other.data))
+
+
+def synthetic_baci(n_rows, n_countries = 200, n_products = 5000, year = 2018, seed = 0):
+    """Function to generate a dataframe shaped like a raw BACI yearly file (columns t, i, j, k, v, q).
+
+    Args:
+        n_rows (int): number of trade flows.
+        n_countries (int): number of distinct numeric country codes.
+        n_products (int): number of distinct HS6 codes.
+        year (int): value of the "t" column.
+        seed (int): seed of the random generator.
+
+    Returns:
+        pd.DataFrame: the synthetic BACI year.
+    """
+    rng = np.random.default_rng(seed)
+    countries = np.arange(4, 4 + 4 * n_countries, 4)
+    chapters = rng.integers(1, 100, n_products)
+    products = chapters * 10000 + rng.integers(0, 10000, n_products)
+    positions = rng.integers(0, n_countries, n_rows)
+    return pd.DataFrame({'t': np.full(n_rows, year, dtype = 'int64'),
+                         'i': countries[positions],
+                         'j': countries[(positions + rng.integers(1, n_countries, n_rows)) % n_countries],   # never the origin
+                         'k': rng.choice(products, n_rows),
+                         'v': rng.lognormal(3, 2, n_rows),
+                         'q': rng.lognormal(2, 2, n_rows)})
+
+
+def synthetic_country_codes(n_countries = 200):
+    """Function to generate a BACI country codes table matching the codes of synthetic_baci.
+    The first code is the Rep. of Korea (ISO3 "KOR"), the next ones carry the names of the EU28 countries
+    so that the EU aggregates are not empty, and the others are named after their code."""
+    codes = np.arange(4, 4 + 4 * n_countries, 4)
+    names = (['Rep. of Korea'] + BACI.eu28 + [f"Country {code}" for code in codes])[:n_countries]
+    iso3 = ['KOR'] + [f"C{code:03d}" for code in codes[1:]]
+    return pd.DataFrame({'country_code': [str(code) for code in codes],
+                         'country_name_abbreviation': names,
+                         'country_name_full': [f"{name} (full name)" for name in names],
+                         'iso_2digit_alpha': [f"{code % 100:02d}" for code in codes],
+                         'iso_3digit_alpha': iso3})
+
+
+def write_synthetic_baci(folder, years, rows, **kwargs):
+    """Write one synthetic BACI file per year in folder, named like the real ones, and the country codes file."""
+    from ingestion import BACI_FILE
+    folder = Path(folder)
+    for year in years:
+        synthetic_baci(rows, year = year, seed = year, **kwargs).to_csv(folder / BACI_FILE.format(year = year), index = False)
+    synthetic_country_codes(kwargs.get('n_countries', 200)).to_csv(folder / 'country_codes.csv', index = False)
+
+
+SHARE_INDUSTRIES = [industry for industry in BACI.dict_industries]
+SHARE_YEARS = range(2007, 2019)
+
+
+def synthetic_shares(n_partners = 200, flow = 'import', reporter = 'Reporter', years = SHARE_YEARS, industries = SHARE_INDUSTRIES, seed = 0):
+    """Function to generate a share dataset shaped like the served files (e.g. data/kor_import.csv): one row per
+    year, partner and industry, with the share of the partner in the total trade and in the trade of the industry.
+
+    Args:
+        n_partners (int): number of partners, named "Partner 0", "Partner 1"...
+        flow (str): "import" (the partner is the origin) or "export" (the partner is the destination).
+        reporter (str): name of the reporter.
+        years (iterable): years of the dataset.
+        industries (list): industry names.
+        seed (int): seed of the random generator.
+
+    Returns:
+        pd.DataFrame: the synthetic share dataset.
+    """
+    rng = np.random.default_rng(seed)
+    years, partners = np.asarray(list(years)), np.array([f"Partner {position}" for position in range(n_partners)], dtype = object)
+    # Shares follow a skewed, slowly drifting distribution so that the rankings change a little every year
+    weights = rng.pareto(1.2, n_partners) + 1e-3
+    total = np.abs(weights[None, :] * np.exp(rng.normal(0, 0.2, (len(years), n_partners)).cumsum(axis = 0)))
+    total = 100 * total / total.sum(axis = 1, keepdims = True)
+    by_industry = rng.dirichlet(np.ones(n_partners) * 0.3, (len(years), len(industries))) * 100
+    year_pos, industry_pos, partner_pos = [grid.ravel() for grid in np.meshgrid(np.arange(len(years)), np.arange(len(industries)), np.arange(n_partners), indexing = 'ij')]
+    df = pd.DataFrame({'year': years[year_pos],
+                       'origin_name': partners[partner_pos] if flow == 'import' else reporter,
+                       'destination_name': reporter if flow == 'import' else partners[partner_pos],
+                       'industry': np.asarray(industries, dtype = object)[industry_pos],
+                       'export_share': total[year_pos, partner_pos],
+                       'export_share_ind': by_industry[year_pos, industry_pos, partner_pos]})
+    return df.sort_values(by = ['year', 'origin_name', 'destination_name'], kind = 'mergesort', ignore_index = True)
+
+
+def write_synthetic_shares(folder, n_reporters, n_partners = 200):
+    """Write the share files of n_reporters synthetic reporters (r000_import.csv, r000_export.csv, ...) in folder."""
+    folder = Path(folder)
+    folder.mkdir(parents = True, exist_ok = True)
+    for position in range(n_reporters):
+        for flow in ['import', 'export']:
+            synthetic_shares(n_partners, flow, f"Reporter {position}", seed = position).to_csv(folder / f'r{position:03d}_{flow}.csv', index = False)
+
+
+def synthetic_flows(n_partners = 50, years = SHARE_YEARS, seed = 0):
+    """Function to generate the yearly flows of a reporter with its partners, with the columns plotted by layout_single
+    and layout_multi (value, value_log, value_change and value_growth), as in the year files of old_app."""
+    rng = np.random.default_rng(seed)
+    years = np.asarray(list(years))
+    frames = []
+    for flow in ['Import', 'Export']:
+        value = np.exp(rng.normal(8, 2, n_partners)[None, :] + rng.normal(0, 0.2, (len(years), n_partners)).cumsum(axis = 0))
+        partners = np.array([f"Partner {position}" for position in range(n_partners)], dtype = object)
+        year_pos, partner_pos = [grid.ravel() for grid in np.meshgrid(np.arange(len(years)), np.arange(n_partners), indexing = 'ij')]
+        previous = np.vstack([np.full((1, n_partners), np.nan), value[:-1]])
+        frames.append(pd.DataFrame({'year': years[year_pos],
+                                    'origin_name': partners[partner_pos] if flow == 'Import' else 'Reporter',
+                                    'destination_name': 'Reporter' if flow == 'Import' else partners[partner_pos],
+                                    'trade_flow': flow,
+                                    'value': value.ravel(),
+                                    'value_log': np.log(value).ravel(),
+                                    'value_change': (value - previous).ravel(),
+                                    'value_growth': (np.log(value) - np.log(previous)).ravel()}))
+    return pd.concat(frames, ignore_index = True)
+
+
+STARTUP_SCRIPT = """
+import json, time
+from benchmarks import memory_usage
+before = memory_usage()
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+after = memory_usage()
+start = time.perf_counter()
+app.build_figure('Total', 10, tuple(app.registry.reporters[:2]))
+first_figure = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'rss': after['rss'] - before['rss'], 'reporters': len(app.registry.reporters), 'first_figure': first_figure}))
+"""
+
+
+def bench_reporters(counts = (2, 10, 50)):
+    """Startup time and memory of the app with 2, 10 and 50 reporters in the data folder, and the time of the first
+    figure of two reporters, which loads them. Each start runs in a fresh interpreter with an in-memory figure cache."""
+    import tempfile
+    from trade_store import build_store
+    for n_reporters in counts:
+        with tempfile.TemporaryDirectory() as folder:
+            write_synthetic_shares(folder, n_reporters)
+            build_store(folder)
+            result = run_isolated(STARTUP_SCRIPT, env = {'DATA_PATH': folder, 'FIGURE_CACHE_PATH': '', 'FIGURE_CACHE_WARM': '0'})
+        print(f"{result['reporters']} reporters: startup {result['seconds']:.2f}s (imports included), rss +{result['rss']:.1f} MB, "
+              f"first figure of 2 reporters {result['first_figure'] * 1000:.0f} ms")
+
+
+def bench_industry_classification(rows = 2000000, apply_rows = 50000):
+    """Compare the lookup-table classification with the row-wise match_industry apply.
+    The apply path is timed on the first apply_rows rows only and its throughput is reported,
+    since running it on millions of rows takes minutes. Returns 1 when the labels differ."""
+    baci = BACI(synthetic_baci(rows), pd.DataFrame())
+    baci.adjust_columns()
+    raw = baci.data
+    _, seconds = timed(baci.industry_classification)
+    print(f"lookup table: {rows:,} rows in {seconds:.3f}s ({rows / seconds:,.0f} rows/s)")
+
+    sample = raw.iloc[:apply_rows].copy()
+    sample["chapters"] = sample["product_code"].str[:2].astype('int32')
+    sample["industry"] = ""
+    legacy, seconds = timed(sample.apply, BACI.match_industry, dictionary = BACI.dict_industries, axis = 1)
+    print(f"row-wise apply: {apply_rows:,} rows in {seconds:.3f}s ({apply_rows / seconds:,.0f} rows/s), "
+          f"~{rows * seconds / apply_rows:.1f}s extrapolated to {rows:,} rows")
+
+    same = (baci.data["industry"].iloc[:apply_rows].astype(str).to_numpy() == legacy["industry"].to_numpy()).all()
+    print(f"same labels: {same}")
+    return int(not same)
+
+
+def clean_full_year(baci, reporter = 'KOR'):
+    """Run the cleaning steps of the notebooks on a whole BACI year (no slicing) and return the memory used by
+    self.data after every step, in MB."""
+    steps = {}
+    for step, func in [('adjust_columns', baci.adjust_columns),
+                       ('match origin', lambda: baci.match_country_codes('origin')),
+                       ('match destination', lambda: baci.match_country_codes('destination')),
+                       ('trade_flow_class', lambda: baci.trade_flow_class({'origin_iso3': reporter, 'destination_iso3': reporter})),
+                       ('industry_classification', baci.industry_classification)]:
+        func()
+        steps[step] = baci.memory_usage().sum() / 2**20
+    return steps
+
+
+def bench_compact(rows = 2000000):
+    """Memory of a synthetic BACI year after every cleaning step, with the default and the compact representation.
+    A full BACI year has about 8 million rows (--rows 8000000). Returns 1 when the labels of the compact data differ
+    from the default data, or the values beyond float32 precision."""
+    raw = synthetic_baci(rows)
+    country_codes = synthetic_country_codes()
+    print(f"raw: {raw.memory_usage(deep = True, index = False).sum() / 2**20:,.1f} MB for {rows:,} rows")
+    results = {}
+    for compact in [False, True]:
+        baci = BACI(raw, country_codes, compact = compact)
+        steps, seconds = timed(clean_full_year, baci)
+        results[compact] = baci
+        print(f"{'compact' if compact else 'default'}: {seconds:.2f}s")
+        for step, mb in steps.items():
+            print(f"  after {step}: {mb:,.1f} MB")
+    print("compact mode, per column:")
+    print(results[True].memory_usage().map(lambda x: f"{x / 2**20:,.1f} MB").to_string())
+    default, labeled = results[False].data, results[True].labels()
+    values = [col for col in default.columns if col not in ['value', 'quantity']]
+    same = all(default[col].astype(str).equals(labeled[col].astype(str)) for col in values)
+    close = all(np.allclose(default[col], labeled[col], rtol = 1e-6, equal_nan = True) for col in ['value', 'quantity'])
+    print(f"same labels: {same}, values equal to float32 precision: {close}")
+    return int(not (same and close))
+
+
+def merge_then_slice(baci, reporter = 'KOR'):
+    """The steps of the notebooks: both merges with the country codes, then the slice on the reporter."""
+    baci.match_country_codes('origin')
+    baci.match_country_codes('destination')
+    baci.slice_countries('or', {'origin_iso3': reporter, 'destination_iso3': reporter})
+    return baci.data
+
+
+def slice_then_resolve(baci, reporter = 'KOR'):
+    """Slice on the numeric codes of the reporter first, then resolve the codes of the rows kept with lookup tables."""
+    baci.slice_reporter(reporter)
+    baci.resolve_country_codes()
+    return baci.data
+
+
+def bench_country_codes(rows = 2000000):
+    """Time and peak traced memory of the country code resolution of a synthetic BACI year, with the merge sequence
+    of the notebooks and with the reporter slice followed by the lookup tables, in both representations.
+    Returns the number of representations in which the two give different rows."""
+    raw = synthetic_baci(rows)
+    country_codes = synthetic_country_codes()
+    mismatches = 0
+    for compact in [False, True]:
+        results = {}
+        for label, func in [('merge, merge, slice', merge_then_slice), ('slice, lookup', slice_then_resolve)]:
+            baci = BACI(raw, country_codes, compact = compact)
+            baci.adjust_columns()
+            data = baci.data
+            _, seconds = timed(func, baci)
+            baci.data = data
+            results[label], _, peak = traced(func, baci)
+            print(f"{'compact' if compact else 'default'} {label}: {seconds:.3f}s, peak traced memory {peak:,.1f} MB, {len(results[label]):,} rows kept")
+        same = same_frames(*results.values())
+        mismatches += not same
+        print(f"same rows: {same}")
+    return mismatches
+
+
+def bench_profile(rows = 200000, repeat = 3):
+    """Run the cleaning and aggregation stages of a synthetic year with the stage metrics, print their summary,
+    and compare the run time with memory tracing off and on. Tracing slows down most the stages that allocate
+    one Python object per row, like the product code padding of adjust_columns."""
+    import profiling
+    raw = synthetic_baci(rows)
+    country_codes = synthetic_country_codes()
+
+    def run():
+        baci = BACI(raw, country_codes)
+        baci.adjust_columns()
+        baci.slice_reporter('KOR')
+        baci.resolve_country_codes()
+        baci.trade_flow_class({'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+        baci.industry_classification()
+        baci.total_flow()
+        baci.aggregate_countries({name: BACI.country_groups[name] for name in ['EU28', 'EU27']})
+
+    for trace_memory in [False, True]:
+        profiling.metrics = profiling.StageMetrics(trace_memory = trace_memory)
+        times = [timed(run)[1] for _ in range(repeat)]
+        print(f"memory tracing {'on' if trace_memory else 'off'}: best of {repeat} {min(times):.3f}s")
+    for stage, summary in profiling.metrics.summary().items():
+        print(f"  {stage}: mean {summary['mean_seconds'] * 1000:.1f} ms, peak {summary['max_peak_mb']:.1f} MB over {summary['count']} calls")
+
+
+LOAD_SCRIPT = """
+import json, time
+import pandas as pd
+from benchmarks import memory_usage
+from trade_store import drop_excluded, read_dataset
+before = memory_usage()
+start = time.perf_counter()
+frames = [{loader} for name in ['mex_import', 'mex_export', 'kor_import', 'kor_export']]
+seconds = time.perf_counter() - start
+sum(float(df['export_share'].sum()) for df in frames)   # touch every share, as serving does over time
+after = memory_usage()
+print(json.dumps({{'seconds': seconds, 'rss': after['rss'] - before['rss'], 'private': after['private'] - before['private']}}))
+"""
+
+
+def bench_trade_store(repeat = 5):
+    """Compare the startup time and memory of one app worker loading the share files from the CSV files
+    and from the memory-mapped store (built first if missing). Each load runs in a fresh interpreter."""
+    from trade_store import build_store
+    if not Path('data/store').exists():
+        build_store(Path('data/'))
+    loaders = {'csv': "drop_excluded(pd.read_csv(f'data/{name}.csv'))", 'mmap store': "read_dataset(f'data/store/{name}')"}
+    for label, loader in loaders.items():
+        runs = [run_isolated(LOAD_SCRIPT.format(loader = loader)) for _ in range(repeat)]
+        best = min(runs, key = lambda x: x['seconds'])
+        print(f"{label}: load {best['seconds'] * 1000:.1f} ms, rss +{best['rss']:.1f} MB, private +{best['private']:.1f} MB")
+
+
+def synthetic_reporter_flows(rows = 1000000, n_years = 2, n_countries = 40, reporter = 'KOR'):
+    """Function to build the cleaned flows of a reporter, as the notebooks feed them to total_flow, from synthetic BACI years.
+    With few countries the reporter takes part in a large share of the rows, as big reporters do in BACI."""
+    country_codes = synthetic_country_codes(n_countries)
+    parts = []
+    for year in range(2018 - n_years + 1, 2019):
+        baci = BACI(synthetic_baci(rows, n_countries = n_countries, year = year, seed = year), country_codes.astype(str))
+        baci.adjust_columns()
+        baci.match_country_codes('origin')
+        baci.match_country_codes('destination')
+        baci.slice_countries('or', {'origin_iso3': reporter, 'destination_iso3': reporter})
+        baci.trade_flow_class({'origin_iso3': reporter, 'destination_iso3': reporter})
+        baci.industry_classification()
+        parts.append(baci.data)
+    return pd.concat(parts, ignore_index = True), country_codes
+
+
+def same_frames(left, right, keys = None):
+    """Return True when two frames hold the same rows in the same order, or in the order of keys when given;
+    sums may differ by float rounding."""
+    def ordered(df):
+        df = df.reset_index(drop = True)
+        if keys is None:
+            return df
+        return df.iloc[df.astype({key: str for key in keys}).sort_values(by = keys, kind = 'mergesort').index].reset_index(drop = True)
+    try:
+        pd.testing.assert_frame_equal(ordered(left), ordered(right), check_dtype = False, check_categorical = False, rtol = 1e-9)
+    except AssertionError as error:
+        print(error)
+        return False
+    return True
+
+
+def bench_aggregation(rows = 2000000, n_years = 3):
+    """Compare total_flow and the EU28/EU27 aggregation with the previous groupby and append code, and check that
+    the outputs are the same: the single pass, the one call per group, and all the groups in one call.
+    Returns the number of outputs that differ, so that the benchmark fails on a mismatch."""
+    data, country_codes = synthetic_reporter_flows(rows, n_years)
+    # Before pandas 1.3 groupby(observed = True) kept the industries in order of appearance: compare in key order
+    keys = ['year', 'trade_flow', 'origin_name', 'destination_name', 'product_code']
+    print(f"{len(data):,} flows of the reporter")
+    legacy, seconds = timed(legacy_total_flow, data)
+    print(f"total_flow, three groupbys: {seconds:.3f}s")
+    baci = BACI(data, country_codes)
+    _, seconds = timed(baci.total_flow)
+    same = [same_frames(legacy, baci.data, keys)]
+    print(f"total_flow, single pass: {seconds:.3f}s, same output: {same[-1]}")
+
+    def legacy_groups(df):
+        df = legacy_aggregate_country(df, BACI.eu28, "EU28", "0")
+        return legacy_aggregate_country(df, BACI.eu27, "EU27", "1")
+    legacy_aggregates, seconds = timed(legacy_groups, legacy)
+    print(f"aggregate_country EU28 + EU27, copy and isin per group: {seconds:.3f}s")
+    aggregated = BACI(baci.data, country_codes)
+    _, seconds = timed(aggregated.aggregate_countries, {"EU28": (BACI.eu28, "0"), "EU27": (BACI.eu27, "1")})
+    same.append(same_frames(legacy_aggregates, aggregated.data, keys))
+    print(f"aggregate_countries EU28 + EU27, single pass: {seconds:.3f}s, same output: {same[-1]}")
+    one_by_one = BACI(baci.data, country_codes)
+    one_by_one.aggregate_country(BACI.eu28, "EU28", "0")
+    one_by_one.aggregate_country(BACI.eu27, "EU27", "1")
+    same.append(same_frames(legacy_aggregates, one_by_one.data, keys))
+    print(f"aggregate_country one group at a time, same output: {same[-1]}")
+    return same.count(False)
+
+
+def bench_incremental(rows = 1000000, n_years = 4, workers = 2):
+    """Time a full build of synthetic years, an update with nothing new, the revision of one year and the release
+    of one more year, and check that the patched share files equal a build from scratch."""
+    import tempfile
+    from incremental import update
+    years = list(range(2015, 2015 + n_years))
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        write_synthetic_baci(folder, years, rows)
+        codes = folder / 'country_codes.csv'
+        for label, run_years in [('full build', years), ('nothing new', years)]:
+            run, seconds = timed(update, run_years, 'KOR', folder, codes, folder / 'work', folder / 'served', workers = workers)
+            print(f"{label}: {seconds:.2f}s, rebuilt {run['rebuilt']}, derived {list(run['derived'])}")
+        revised = years[1]
+        synthetic_baci(rows, year = revised, seed = 1).to_csv(folder / f'BACI_HS07_Y{revised}_V202001.csv', index = False)
+        run, seconds = timed(update, years, 'KOR', folder, codes, folder / 'work', folder / 'served', workers = workers)
+        print(f"revised {revised}: {seconds:.2f}s, rebuilt {run['rebuilt']}, derived {run['derived']}")
+        new_year = years[-1] + 1
+        write_synthetic_baci(folder, [new_year], rows)
+        run, seconds = timed(update, years + [new_year], 'KOR', folder, codes, folder / 'work', folder / 'served', workers = workers)
+        print(f"released {new_year}: {seconds:.2f}s, rebuilt {run['rebuilt']}, derived {run['derived']}")
+        update(years + [new_year], 'KOR', folder, codes, folder / 'scratch', folder / 'scratch_served', workers = workers)
+        same = all(same_frames(pd.read_csv(folder / 'served' / name), pd.read_csv(folder / 'scratch_served' / name)) for name in ['kor_import.csv', 'kor_export.csv'])
+        same = same and all(same_frames(pd.read_csv(folder / 'work' / 'derived' / f'kor_{year}.csv', dtype = str), pd.read_csv(folder / 'scratch' / 'derived' / f'kor_{year}.csv', dtype = str))
+                            for year in years + [new_year])
+        print(f"patched partitions and share files equal a build from scratch: {same}")
+
+
+def notebook_derived(df):
+    """The derived columns as the notebooks (and old_app, for value_log and value_growth) computed them."""
+    df = df.copy()
+    df['total_trade'] = df.groupby(['year', 'product_code', 'trade_flow'])['value'].transform(lambda x: x.sum())
+    df['value_change'] = df.groupby(['origin_name', 'destination_name', 'product_code'], as_index = False)['value'].diff()
+    df['total_percentage'] = (df['value']/df['total_trade'])*100
+    df['value_log'] = np.log(df['value'])
+    df['value_growth'] = df['value_change']/(df['value'] - df['value_change'])
+    return df
+
+
+def bench_derived(rows = 1000000, n_years = 4):
+    """Compare the derived columns of the notebooks with derive_metrics on the aggregated flows of synthetic years.
+    The notebooks diff a flow with its previous row, derive_metrics with the previous calendar year: the value_change
+    of a flow after a year without trade is only compared to be missing."""
+    from derived import derive_metrics
+    df, _ = synthetic_reporter_flows(rows, n_years = n_years)
+    baci = BACI(df, pd.DataFrame())
+    baci.total_flow()
+    baci.aggregate_countries({name: BACI.country_groups[name] for name in ['EU28', 'EU27']})
+    legacy, legacy_seconds = timed(notebook_derived, baci.data)
+    derived, seconds = timed(derive_metrics, baci.data)
+    print(f"{len(baci.data):,} aggregated rows over {n_years} years")
+    print(f"notebooks (transform lambda, groupby diff, np.log): {legacy_seconds:.2f}s")
+    print(f"derive_metrics, one pass: {seconds:.2f}s")
+    previous_year = baci.data.groupby(['origin_name', 'destination_name', 'product_code'])['year'].shift()
+    gap = (previous_year < baci.data['year'] - 1).to_numpy()
+    repeated = (previous_year == baci.data['year']).to_numpy()   # several rows of a flow in a year
+    compared = ~gap & ~repeated
+    columns = ['total_trade', 'total_percentage', 'value_log', 'value_change', 'value_growth']
+    same = same_frames(legacy.loc[compared, columns], derived.loc[compared, columns])
+    print(f"same columns: {same} ({compared.sum():,} rows), {gap.sum():,} rows after a gap year missing value_change: "
+          f"{derived.loc[gap, 'value_change'].isna().all()}, {repeated.sum():,} repeated rows not compared")
+
+
+def bench_refresh(n_partners = 230, requests = 40):
+    """Serve figures from a ReporterRegistry while the share files of its reporters are rewritten and the registry
+    refreshes in a background thread, and compare the latency with the one of an idle registry."""
+    import tempfile
+    import threading
+    from plots_layout import layout_share
+    from reporters import ReporterRegistry
+    from trade_store import build_store
+    with tempfile.TemporaryDirectory() as folder:
+        write_synthetic_shares(folder, 2, n_partners)
+        build_store(folder)
+        registry = ReporterRegistry(folder, ['Total'] + SHARE_INDUSTRIES)
+        reporters = registry.reporters
+
+        def serve():
+            frames, index = registry.select(reporters)
+            return layout_share(frames, 'Total', 10, reporters, index = index)
+        serve()
+        idle = [timed(serve)[1] for _ in range(requests)]
+        for position in range(2):
+            for flow in ['import', 'export']:
+                synthetic_shares(n_partners, flow, f"Reporter {position}", seed = 100 + position).to_csv(Path(folder) / f'r{position:03d}_{flow}.csv', index = False)
+        build_store(folder)
+        result = {}
+        start = time.perf_counter()
+        refresh = threading.Thread(target = lambda: result.update(reloaded = registry.refresh(), seconds = time.perf_counter() - start))
+        refresh.start()
+        during = []
+        while refresh.is_alive() or len(during) < requests:
+            during.append(timed(serve)[1])
+        refresh.join()
+        latency_summary("idle", idle)
+        latency_summary("during refresh", during)
+        print(f"refresh reloaded {result['reloaded']} in {result['seconds']:.2f}s while serving {len(during)} requests")
+
+
+def bench_query_store(rows = 1000000, n_years = 4, queries = 50, workers = 2):
+    """Serve the callbacks of old_app from the derived flows of synthetic years: scanning the whole frame in memory with
+    isin, as old_app did, against the query store. Checks that both return the same rows, for random products and
+    for the zero-padded chapters 01 to 09 offered by product_choice, and returns the number of requests that differ."""
+    import tempfile
+    from incremental import update
+    from plots_layout import product_choice
+    from query_store import COLUMNS, QueryStore, pad_product_codes
+    years = list(range(2018 - n_years + 1, 2019))
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        write_synthetic_baci(folder, years, rows)
+        _, seconds = timed(update, years, 'KOR', folder, folder / 'country_codes.csv', folder / 'work', folder / 'served', workers = workers,
+                           query_path = folder / 'baci.sqlite')
+        df = pd.concat([pd.read_csv(folder / 'work' / 'derived' / f'kor_{year}.csv', dtype = {'product_code': 'str'}) for year in years], ignore_index = True)
+        # old_app padded the chapters and HS6 codes when it read the flows
+        df['product_code'] = pad_product_codes(df['product_code'])
+        store = QueryStore(folder / 'baci.sqlite')
+        print(f"{len(df):,} derived rows: {df.memory_usage(deep = True).sum() / 2**20:,.0f} MB in memory, "
+              f"{store.nbytes() / 2**20:,.0f} MB query store (update with the store: {seconds:.1f}s)")
+        partners = store.partners('KOR')
+        requests = []
+        for _ in range(queries):
+            country = list(rng.choice(partners, rng.integers(1, 4), replace = False))
+            requests.append((country, rng.choice(store.products('KOR', country[:1]))))
+        requests += [(list(rng.choice(partners, 2, replace = False)), f'0{chapter}') for chapter in range(1, 10)]
+        times = {'scan': [], 'store': [], 'products scan': [], 'products store': []}
+        mismatches = 0
+        for country, hs in requests:
+            scanned, seconds = timed(lambda: df[(df['origin_name'].isin(country) | df['destination_name'].isin(country)) & (df['product_code'] == hs)])
+            times['scan'].append(seconds)
+            stored, seconds = timed(store.flows, 'KOR', country, hs)
+            times['store'].append(seconds)
+            columns = [col for col in COLUMNS if col != 'partner']
+            mismatches += not same_frames(scanned[columns].sort_values(by = ['trade_flow', 'origin_name', 'destination_name', 'year']), stored[columns])
+            scanned_products, seconds = timed(lambda: product_choice(df[df['origin_name'].isin(country) | df['destination_name'].isin(country)]))
+            times['products scan'].append(seconds)
+            stored_products, seconds = timed(lambda: product_choice(store.products('KOR', country)))
+            times['products store'].append(seconds)
+            mismatches += scanned_products != stored_products
+        for label, seconds in times.items():
+            latency_summary(label, seconds)
+        empty = sum(store.flows('KOR', partners, f'0{chapter}').empty for chapter in range(1, 10))
+        print(f"requests with different results: {mismatches}, chapters 01 to 09 without rows: {empty}")
+        return mismatches + empty
+
+
+def latency_summary(label, seconds):
+    seconds = np.sort(np.array(seconds)) * 1000
+    print(f"{label}: mean {seconds.mean():.1f} ms, p50 {np.percentile(seconds, 50):.1f} ms, "
+          f"p95 {np.percentile(seconds, 95):.1f} ms, max {seconds[-1]:.1f} ms over {len(seconds)} calls")
+
+
+def bench_share_callback(tops = range(1, 51)):
+    """Callback latency of the share plot for every industry and top value, ranking on every call
+    (the previous layout_share) and with the ranking index built at load time.
+    Every pair of figures is checked to be identical; returns the number that differ."""
+    from plots_layout import layout_share, ranking_index
+    from app import dict_industries
+    frames, csv_frames = load_shares(), load_shares(csv = True)
+    index, seconds = timed(ranking_index, frames, dict_industries.keys())
+    print(f"ranking index built in {seconds * 1000:.1f} ms")
+    legacy_times, indexed_times, mismatches = [], [], 0
+    for industry in dict_industries:
+        for top in tops:
+            legacy, seconds = timed(legacy_layout_share, *csv_frames.values(), industry, top)
+            legacy_times.append(seconds)
+            fig, seconds = timed(layout_share, frames, industry, top, REPORTERS, index = index)
+            indexed_times.append(seconds)
+            mismatches += not same_traces(fig, legacy)
+    latency_summary("ranking per call", legacy_times)
+    latency_summary("ranking index", indexed_times)
+    ranking = [timed(ranking_index, frames, [industry])[1] for industry in dict_industries]
+    latency_summary("ranking step alone", ranking)
+    print(f"figures with different traces: {mismatches}")
+    return mismatches
+
+
+def bench_figure_cache(requests = 300, max_top = 20, cache_mb = 4):
+    """Replay random (industry, top) requests through the figure cache, with the in-memory and the SQLite
+    backend, and report the miss and hit latencies and the cache counters."""
+    import tempfile
+    from figure_cache import DiskBackend, FigureCache, MemoryBackend
+    from app import build_figure, dict_industries
+    rng = np.random.default_rng(0)
+    industries = list(dict_industries)
+    # Small top values are much more frequent, like in real use
+    inputs = [(industries[rng.integers(len(industries))], int(min(rng.zipf(1.5), max_top)), tuple(REPORTERS)) for _ in range(requests)]
+    with tempfile.TemporaryDirectory() as folder:
+        for label, backend in [('memory', MemoryBackend(cache_mb * 2**20)), ('sqlite', DiskBackend(Path(folder) / 'figures.sqlite', cache_mb * 2**20))]:
+            cache = FigureCache(backend)
+            hits, misses = [], []
+            for key in inputs:
+                before = cache.stats()['hits']
+                _, seconds = timed(cache.get_or_build, key, build_figure)
+                (hits if cache.stats()['hits'] > before else misses).append(seconds)
+            print(f"{label} backend: {cache.stats()}")
+            latency_summary("  miss", misses)
+            latency_summary("  hit", hits)
+
+
+def bench_share_traces(top = 50):
+    """Build the top-50 share figure of every industry with the previous per-row iloc hover text
+    and with the grouped trace construction, checking that the figures are identical; returns the number that differ."""
+    from plots_layout import layout_share, ranking_index
+    from app import dict_industries
+    frames, csv_frames = load_shares(), load_shares(csv = True)
+    index = ranking_index(frames, dict_industries.keys())
+    results = {'iloc per row': [], 'grouped': []}
+    mismatches = 0
+    for industry in dict_industries:
+        legacy, seconds = timed(legacy_layout_share, *csv_frames.values(), industry, top)
+        results['iloc per row'].append((seconds, traced(legacy_layout_share, *csv_frames.values(), industry, top)[2]))
+        fig, seconds = timed(layout_share, frames, industry, top, REPORTERS, index = index)
+        results['grouped'].append((seconds, traced(layout_share, frames, industry, top, REPORTERS, index = index)[2]))
+        mismatches += not same_traces(fig, legacy)
+    for label, runs in results.items():
+        seconds, peaks = zip(*runs)
+        print(f"{label}: mean {np.mean(seconds) * 1000:.1f} ms, mean peak traced memory {np.mean(peaks):.1f} MB (top {top})")
+    print(f"figures with different traces: {mismatches}")
+    return mismatches
+
+
+def dash_request(client, output, inputs):
+    """POST one callback of the app to its Dash endpoint, as the browser does, and return the size of the response.
+
+    Args:
+        client (FlaskClient): test client of the app server.
+        output (tuple): (id, property) of the output.
+        inputs (list): (id, value) of the value inputs, in the order of the callback.
+    """
+    payload = {'output': '.'.join(output), 'outputs': {'id': output[0], 'property': output[1]},
+               'inputs': [{'id': id, 'property': 'value', 'value': value} for id, value in inputs],
+               'changedPropIds': [f'{id}.value' for id, _ in inputs], 'state': []}
+    response = client.post('/_dash-update-component', json = payload)
+    if response.status_code not in (200, 204):
+        raise RuntimeError(response.get_data(as_text = True))
+    return len(response.data)
+
+
+def serving_sessions(app, sessions, changes, threads, industry_changes = 0.1, seed = 0):
+    """Replay user sessions against the callbacks of the app in its serving mode and time the requests the server gets.
+    A session opens the page (one request per server callback) and then makes changes: a new industry with probability
+    industry_changes, otherwise a new top value, which the client mode draws in the browser without a request."""
+    from concurrent.futures import ThreadPoolExecutor
+    rng = np.random.default_rng(seed)
+    industries = list(app.dict_industries)
+    reporters = app.default_reporters
+    plans = [[('industry', industries[rng.integers(len(industries))]) if rng.random() < industry_changes else ('top', int(min(rng.zipf(1.5), 50)))
+              for _ in range(changes)] for _ in range(sessions)]
+
+    def session(plan):
+        client = app.server.test_client()
+        top, industry = 3, 'Total'
+        requests, nbytes, busy = 0, 0, 0.0
+        for kind, value in [(None, None)] + plan:
+            if kind == 'top':
+                top = value
+            elif kind == 'industry':
+                industry = value
+            if app.serving_mode == 'client':
+                if kind == 'top':
+                    continue
+                output, inputs = ('share-data', 'data'), [('product-dropdown', industry), ('reporter-dropdown', reporters)]
+            else:
+                output, inputs = ('line-chart', 'figure'), [('styled-numeric-input', top), ('product-dropdown', industry), ('reporter-dropdown', reporters)]
+            size, seconds = timed(dash_request, client, output, inputs)
+            requests, nbytes, busy = requests + 1, nbytes + size, busy + seconds
+        return requests, nbytes, busy
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(session, plans))
+    seconds = time.perf_counter() - start
+    requests, nbytes, busy = (sum(values) for values in zip(*results))
+    return {'mode': app.serving_mode, 'sessions': sessions, 'requests': requests, 'seconds': seconds, 'bytes': nbytes,
+            'busy_seconds': busy, 'figure_cache': app.figure_cache.stats()}
+
+
+SERVING_SCRIPT = """
+import json
+import app
+from benchmarks import serving_sessions
+print(json.dumps(serving_sessions(app, {sessions}, {changes}, {threads})))
+"""
+
+
+def trace_values(trace):
+    """Return the plotted values of a scatter trace, given as a plotly trace or as the dictionary drawn in the browser."""
+    trace = trace if isinstance(trace, dict) else trace.to_plotly_json()
+    values = lambda key: np.asarray(trace[key]).tolist()
+    return json.dumps([trace['name'], trace['xaxis'], trace['yaxis'], trace['mode'], values('x'), values('y'), values('hovertext')])
+
+
+CLIENTSIDE_SCRIPT = """
+const fs = require('fs');
+const {topFigure} = require(process.argv[1]);
+const data = JSON.parse(fs.readFileSync(process.argv[2]));
+const tops = JSON.parse(process.argv[3]);
+const start = process.hrtime.bigint();
+const figures = tops.map(top => topFigure(data, top));
+const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+console.log(JSON.stringify({seconds: seconds, traces: figures.map(figure => figure.data)}));
+"""
+
+
+def check_clientside(tops = [-2, 0, 2.5] + list(range(1, 51))):
+    """Draw the share figures of every industry and top with assets/share_clientside.js under node and count the ones
+    whose traces differ from layout_share for the top the server uses (max(1, int(top))). Returns None when node is
+    not installed."""
+    import shutil
+    import tempfile
+    from plots_layout import layout_share, ranking_index, share_series
+    from app import dict_industries
+    node = shutil.which('node')
+    if node is None:
+        return None
+    frames = load_shares()
+    index = ranking_index(frames, dict_industries.keys())
+    mismatches, seconds = 0, []
+    with tempfile.TemporaryDirectory() as folder:
+        for industry in dict_industries:
+            path = Path(folder) / 'series.json'
+            path.write_text(json.dumps(share_series(frames, industry, REPORTERS, index = index)))
+            process = subprocess.run([node, '-e', CLIENTSIDE_SCRIPT, str(Path('assets/share_clientside.js').resolve()), str(path), json.dumps(list(tops))],
+                                     capture_output = True, text = True, check = True)
+            result = json.loads(process.stdout)
+            seconds.append(result['seconds'] / len(tops))
+            for top, traces in zip(tops, result['traces']):
+                fig = layout_share(frames, industry, max(1, int(top)), REPORTERS, index = index)
+                mismatches += [trace_values(trace) for trace in fig.data] != [trace_values(trace) for trace in traces]
+    return {'mismatches': mismatches, 'figures': len(tops) * len(dict_industries), 'seconds': float(np.mean(seconds))}
+
+
+def bench_serving(sessions = 200, changes = 20, threads = 4):
+    """Load test of the two serving modes of the app (SERVING_MODE): simulated sessions that mostly change the top value
+    and sometimes the industry, sent from several threads to the Dash endpoint of a fresh app with an in-memory figure
+    cache. Reports the requests the server gets and how many it answers per second, and checks under node that the
+    clientside figures have the same traces as the server ones."""
+    for mode in ['server', 'client']:
+        result = run_isolated(SERVING_SCRIPT.format(sessions = sessions, changes = changes, threads = threads),
+                              env = {'SERVING_MODE': mode, 'FIGURE_CACHE_PATH': '', 'FIGURE_CACHE_WARM': '0', 'REFRESH_INTERVAL': '0'})
+        print(f"{mode}: {result['requests'] / sessions:.1f} requests per session, {result['requests'] / result['seconds']:.0f} requests/s, "
+              f"{sessions / result['seconds']:.1f} sessions/s, {result['busy_seconds'] / sessions * 1000:.0f} ms of server time and "
+              f"{result['bytes'] / sessions / 2**10:,.0f} KB sent per session (figure cache: {result['figure_cache']})")
+    check = check_clientside()
+    if check is None:
+        print("node not found: clientside figures not checked")
+    else:
+        print(f"clientside figure: {check['seconds'] * 1000:.2f} ms in node, {check['mismatches']} of {check['figures']} figures with different traces")
+        return check['mismatches']
+
+
+LEGACY_INGESTION_SCRIPT = """
+import json, resource, time
+from benchmarks import *
+from ingestion import BACI_FILE, load_country_codes
+country_codes = load_country_codes('{folder}/country_codes.csv')
+start = time.perf_counter()
+full = pd.DataFrame()
+for year in {years}:
+    baci = BACI(pd.read_csv(Path('{folder}') / BACI_FILE.format(year = year)), country_codes)
+    baci.adjust_columns()
+    baci.match_country_codes('origin')
+    baci.match_country_codes('destination')
+    baci.slice_countries('or', {{'origin_iso3': 'KOR', 'destination_iso3': 'KOR'}})
+    baci.trade_flow_class({{'origin_iso3': 'KOR', 'destination_iso3': 'KOR'}})
+    baci.industry_classification()
+    baci.data.to_csv(Path('{folder}') / f'legacy_{{year}}.csv', index = False)
+    full = pd.concat([full, baci.data], ignore_index = True)   # DataFrame.append in the notebooks
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'rows': len(full), 'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+PIPELINE_INGESTION_SCRIPT = """
+import json, resource, time
+from ingestion import ingest, load_country_codes, read_partitions
+country_codes = load_country_codes('{folder}/country_codes.csv')
+start = time.perf_counter()
+ingest({years}, 'KOR', '{folder}', '{folder}/partitions', country_codes, workers = {workers}, chunksize = {chunksize})
+seconds = time.perf_counter() - start
+rows = len(read_partitions('{folder}/partitions', 'KOR', {years}))
+peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+print(json.dumps({{'seconds': seconds, 'rows': rows, 'peak': peak}}))
+"""
+
+
+def bench_ingestion(rows = 1000000, n_years = 4, workers = 4, chunksize = 250000):
+    """Compare the serial cleaning_baci loop of the notebooks with the parallel, chunked ingestion
+    on synthetic BACI years. Peak memory is the largest resident set of a single process (MB)."""
+    import tempfile
+    years = list(range(2015, 2015 + n_years))
+    with tempfile.TemporaryDirectory() as folder:
+        write_synthetic_baci(folder, years, rows)
+        legacy = run_isolated(LEGACY_INGESTION_SCRIPT.format(folder = folder, years = years))
+        pipeline = run_isolated(PIPELINE_INGESTION_SCRIPT.format(folder = folder, years = years, workers = workers, chunksize = chunksize))
+        same = all((Path(folder) / f'legacy_{year}.csv').read_bytes() == (Path(folder) / 'partitions' / f'kor_{year}.csv').read_bytes() for year in years)
+    print(f"{n_years} years of {rows:,} rows")
+    print(f"serial loop: {legacy['seconds']:.2f}s, peak {legacy['peak']:.0f} MB, {legacy['rows']:,} rows kept")
+    print(f"parallel chunked ({workers} workers, chunks of {chunksize:,}): {pipeline['seconds']:.2f}s, "
+          f"peak {pipeline['peak']:.0f} MB per process, {pipeline['rows']:,} rows kept")
+    print(f"same partitions: {same}")
+
+
+SUITE_SCALES = {'small': {'rows': 100000, 'partners': 50}, 'medium': {'rows': 1000000, 'partners': 200}, 'large': {'rows': 4000000, 'partners': 230}}
+SUITE_BASELINE = Path('benchmark_baseline.json')
+
+
+def notebook_pipeline(baci):
+    """The cleaning loop of the notebooks on one year, followed by the aggregation steps."""
+    baci.adjust_columns()
+    baci.match_country_codes('origin')
+    baci.match_country_codes('destination')
+    baci.slice_countries('or', {'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+    baci.trade_flow_class({'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+    baci.industry_classification()
+    baci.total_flow()
+    baci.aggregate_countries({name: BACI.country_groups[name] for name in ['EU28', 'EU27']})
+
+
+def ingestion_pipeline(baci):
+    """The cleaning steps of ingestion.clean_year on one year, followed by the aggregation steps."""
+    baci.adjust_columns()
+    baci.slice_reporter('KOR')
+    baci.resolve_country_codes()
+    baci.trade_flow_class({'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+    baci.industry_classification()
+    if baci.compact:
+        baci.expand()
+    baci.total_flow()
+    baci.aggregate_countries({name: BACI.country_groups[name] for name in ['EU28', 'EU27']})
+
+
+def stage_cases(scale, repeat, memory):
+    """Time every BACI stage of the two pipelines on a synthetic year, through the stage metrics of profiling.
+    The seconds of a stage are the best over the runs of the sum of its calls in a run (match_country_codes runs twice)."""
+    import profiling
+    raw = synthetic_baci(scale['rows'])
+    country_codes = synthetic_country_codes()
+    cases = {}
+    for name, pipeline in [('notebook', notebook_pipeline), ('ingestion', ingestion_pipeline)]:
+        for compact in ([False, True] if name == 'ingestion' else [False]):
+            label = f"{name}{' compact' if compact else ''}"
+            runs = []
+            for trace_memory in [False] * repeat + [True] * memory:
+                profiling.metrics = profiling.StageMetrics(trace_memory = trace_memory)
+                pipeline(BACI(raw, country_codes, compact = compact))
+                run = {}
+                for record in profiling.metrics.records:
+                    stage = run.setdefault(record['stage'], {'seconds': 0.0, 'peak_mb': None})
+                    stage['seconds'] += record['seconds']
+                    if record['peak_mb'] is not None:
+                        stage['peak_mb'] = max(stage['peak_mb'] or 0.0, record['peak_mb'])
+                runs.append((trace_memory, run))
+            for stage in runs[0][1]:
+                cases[f"{label}/{stage}"] = {'seconds': min(run[stage]['seconds'] for traced_run, run in runs if not traced_run),
+                                             'peak_mb': max([run[stage]['peak_mb'] for traced_run, run in runs if traced_run], default = None)}
+    profiling.metrics = profiling.StageMetrics()
+    return cases
+
+
+def figure_cases(scale, repeat, memory):
+    """Time the figure builders of plots_layout on synthetic share files and flows of scale['partners'] partners."""
+    from plots_layout import layout_multi, layout_share, layout_single, ranking_index
+    reporters = ['r000', 'r001']
+    frames = {f'{reporter}_{flow}': synthetic_shares(scale['partners'], flow, reporter, seed = seed)
+              for seed, reporter in enumerate(reporters) for flow in ['import', 'export']}
+    index = ranking_index(frames, ['Total', 'Chemical'])
+    flows = synthetic_flows(scale['partners'])
+    countries = [f"Partner {position}" for position in range(min(10, scale['partners']))]
+    calls = {'ranking_index': lambda: ranking_index(frames, ['Total', 'Chemical']),
+             'layout_share top 10': lambda: layout_share(frames, 'Chemical', 10, reporters, index = index),
+             'layout_share top 50': lambda: layout_share(frames, 'Total', 50, reporters, index = index),
+             'layout_single': lambda: layout_single(flows[(flows['origin_name'] == 'Partner 0') | (flows['destination_name'] == 'Partner 0')], 'Log'),
+             'layout_multi 10 countries': lambda: layout_multi(flows, countries, 'Growth rate')}
+    cases = {}
+    for name, call in calls.items():
+        cases[f"figures/{name}"] = {'seconds': min(timed(call)[1] for _ in range(repeat)),
+                                    'peak_mb': traced(call)[2] if memory else None}
+    return cases
+
+
+def calibration(repeat = 5):
+    """Best time of a fixed pandas workload (sort, factorize and grouped sum of 1M rows), measured with every suite
+    run so that the times of a run can be compared with a baseline saved while the machine was more or less busy."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'key': rng.integers(0, 10000, 1000000).astype(str), 'value': rng.random(1000000)})
+
+    def workload():
+        return df.sort_values(by = 'value').groupby('key')['value'].sum()
+    return min(timed(workload)[1] for _ in range(repeat))
+
+
+def compare_baseline(results, baseline, threshold, speed = 1.0, min_seconds = 0.01):
+    """Function to compare suite results with a baseline.
+    A case regresses when it takes more than threshold times its baseline seconds scaled by speed (the ratio of the
+    calibration times of the run and of the baseline), and at least min_seconds more, or, when both have it, more
+    than threshold times its baseline peak memory. A case missing from the baseline fails as well.
+
+    Returns:
+        list: the description of every regression.
+    """
+    regressions = []
+    for case, result in sorted(results.items()):
+        base = baseline.get(case)
+        if base is None:
+            print(f"  {case}: {result['seconds'] * 1000:.1f} ms NO BASELINE")
+            regressions.append(f"{case}: not in the baseline, save a new one with --save")
+            continue
+        ratio = result['seconds'] / (base['seconds'] * speed) if base['seconds'] else float('inf')
+        slower = ratio > threshold and result['seconds'] - base['seconds'] * speed > min_seconds
+        heavier = result['peak_mb'] is not None and base['peak_mb'] and result['peak_mb'] > threshold * base['peak_mb']
+        print(f"  {case}: {result['seconds'] * 1000:.1f} ms vs {base['seconds'] * 1000:.1f} ms ({ratio:.2f}x calibrated){' REGRESSION' if slower or heavier else ''}")
+        if slower:
+            regressions.append(f"{case}: {ratio:.2f}x the baseline time")
+        if heavier:
+            regressions.append(f"{case}: {result['peak_mb']:.1f} MB peak vs {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+def bench_suite(scales = ('small', 'medium'), repeat = 3, memory = False, save = False, threshold = 1.75, baseline = SUITE_BASELINE):
+    """Run the BACI stages and the figure builders at several scales and compare them with the stored baseline.
+
+    Args:
+        scales (iterable): names of SUITE_SCALES to run.
+        repeat (int): runs per case; the best time is kept.
+        memory (bool): measure the peak traced memory of every case in one more run (slow for the notebook stages).
+        save (bool): store the results as the new baseline instead of comparing with it. Without it the baseline
+            must exist.
+        threshold (float): ratio to the baseline above which a case regresses.
+        baseline (Path): JSON file of the baseline. Timings only compare on the machine that saved it.
+
+    Returns:
+        list: the regressions found, or the missing baseline.
+    """
+    import platform
+    baseline = Path(baseline)
+    if not save and not baseline.exists():
+        print(f"no baseline in {baseline}: run the suite with --save on the reference machine first")
+        return [f"missing baseline {baseline}"]
+    reference = calibration()
+    results = {}
+    for scale in scales:
+        print(f"scale {scale}: {SUITE_SCALES[scale]}")
+        for case, result in dict(stage_cases(SUITE_SCALES[scale], repeat, memory), **figure_cases(SUITE_SCALES[scale], repeat, memory)).items():
+            results[f"{scale}/{case}"] = result
+    # The load of the machine can change during the run: calibrate at both ends
+    reference = (reference + calibration()) / 2
+    if save:
+        with open(baseline, 'w') as f:
+            json.dump({'machine': platform.node(), 'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'calibration': reference, 'cases': results}, f, indent = 1, sort_keys = True)
+        print(f"baseline of {len(results)} cases saved to {baseline}")
+        return []
+    with open(baseline) as f:
+        stored = json.load(f)
+    speed = reference / stored['calibration']
+    print(f"compared with {baseline} ({stored['machine']}, {stored['time']}), threshold {threshold}x, "
+          f"calibration {reference * 1000:.0f} ms vs {stored['calibration'] * 1000:.0f} ms:")
+    regressions = compare_baseline(results, stored['cases'], threshold, speed)
+    print(f"{len(regressions)} regressions" + ''.join(f"\n  {regression}" for regression in regressions))
+    return regressions
+
+
+BENCHMARKS = {'aggregation': bench_aggregation, 'cache': bench_figure_cache, 'compact': bench_compact, 'derived': bench_derived, 'countries': bench_country_codes, 'incremental': bench_incremental, 'industry': bench_industry_classification, 'ingestion': bench_ingestion, 'profile': bench_profile, 'query': bench_query_store, 'refresh': bench_refresh, 'reporters': bench_reporters, 'serving': bench_serving, 'share': bench_share_callback, 'traces': bench_share_traces, 'store': bench_trade_store, 'suite': bench_suite}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run a benchmark on synthetic data.")
+    parser.add_argument('benchmark', choices = sorted(BENCHMARKS))
+    parser.add_argument('--rows', type = int, help = "number of synthetic rows")
+    parser.add_argument('--scales', nargs = '+', choices = sorted(SUITE_SCALES), help = "suite: scales to run")
+    parser.add_argument('--repeat', type = int, help = "suite: runs per case")
+    parser.add_argument('--memory', action = 'store_true', default = None, help = "suite: measure the peak memory of every case")
+    parser.add_argument('--save', action = 'store_true', default = None, help = "suite: store the results as the baseline")
+    parser.add_argument('--threshold', type = float, help = "suite: ratio to the baseline above which a case regresses")
+    parser.add_argument('--baseline', type = Path, help = "suite: baseline file")
+    parser.add_argument('--sessions', type = int, help = "serving: number of simulated sessions")
+    parser.add_argument('--threads', type = int, help = "serving: concurrent sessions")
+    args = parser.parse_args()
+    benchmark = BENCHMARKS[args.benchmark]
+    parameters = inspect.signature(benchmark).parameters
+    kwargs = {name: value for name, value in vars(args).items() if name in parameters and value is not None}
+    if benchmark(**kwargs):
+        sys.exit(1)   # the suite returns its regressions, the checks of the outputs their mismatches
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
 import pandas as pd
 import numpy as np
 
+from profiling import profiled
 from utilities import *
 
+
+def data_rows(baci, *args, **kwargs):
+    """Return the number of rows of a BACI dataframe, for the metrics of its stages."""
+    return len(baci.data)
+
+
 class BACI():
     
     dict_industries = {"Agri_Food": [1, 24], "Mineral products": [25, 27], "Chemical": [28, 38],
@@ -20,23 +27,94 @@ class BACI():
             "Denmark", "Estonia", "Finland", "France", "Germany", "Greece",
             "Hungary", "Ireland", "Italy", "Latvia", "Lithuania", "Malta", "Netherlands",
             "Poland", "Portugal", "Romania", "Slovakia", "Slovenia", "Spain", "Sweden"]
+
+    usmca = ["Canada", "Mexico", "USA"]
+
+    country_groups = {"EU28": (eu28, "0"), "EU27": (eu27, "1"), "USMCA": (usmca, "2")}
     
-    def __init__(self, input, df_country_codes):
+    flow_categories = ['', 'Export', 'Import']
+
+    def __init__(self, input, df_country_codes, compact = False):
+        """
+        Args:
+            input (pd.DataFrame): raw BACI flows.
+            df_country_codes (pd.DataFrame): BACI country codes.
+            compact (bool): keep the country and product codes as integers, the names, ISO3, industry and trade flow
+                as categoricals and the value and quantity as float32 (about 7 significant digits) until labels() is called.
+                The compact mode covers the cleaning steps, from adjust_columns to industry_classification; expand()
+                switches to the default representation before total_flow.
+        """
         self.data = input.copy()
         self.country_names = df_country_codes
-        self.log = logs('BACI_dataframes', input)
+        self.compact = compact
+        self.product_labels = None
+        self.log = logs('BACI_dataframes', 'BACI')
     
-    def info(self):
+    def info(self, memory = True):
         print(self.data.dtypes)
         print(self.data.head())
         print(self.data.tail())
         print(self.data.shape)
+        if memory:
+            usage = self.memory_usage()
+            print(usage.map(lambda x: f"{x / 2**20:,.1f} MB"))
+            print(f"total: {usage.sum() / 2**20:,.1f} MB")
+
+    def memory_usage(self):
+        """Return the memory used by every column of self.data in bytes, including the strings held by object columns."""
+        return self.data.memory_usage(deep = True, index = False)
 
+    @profiled('BACI.adjust_columns', rows = data_rows)
     def adjust_columns(self):
-        self.data = self.data.astype({'t': 'int32', 'i': 'str', 'j': 'str', 'k': 'str'})
+        if self.compact:
+            self.data = self.data.astype({'t': 'int16', 'i': 'int32', 'j': 'int32', 'k': 'int32', 'v': 'float32'})
+            self.data['q'] = pd.to_numeric(self.data['q'], errors = 'coerce').astype('float32')
+        else:
+            self.data = self.data.astype({'t': 'int32', 'i': 'str', 'j': 'str', 'k': 'str'})
         self.data.rename(columns = {'t': 'year', 'i': 'origin', 'j': 'destination', 'k': 'product_code', 'v': 'value', 'q': 'quantity'}, inplace = True)
-        self.data['product_code'] = self.data['product_code'].apply(lambda x: '0' + x if len(x) < 6 else x)
+        if self.compact:
+            # The zero-padded labels are only built for the distinct codes and joined in labels()
+            codes = np.unique(self.data['product_code'].to_numpy())
+            self.product_labels = pd.Series(np.char.zfill(codes.astype(str), 6).astype(object), index = codes)
+        else:
+            self.data['product_code'] = self.data['product_code'].apply(lambda x: '0' + x if len(x) < 6 else x)
+
+    @profiled('BACI.expand', rows = data_rows)
+    def expand(self):
+        """Function to switch self.data from the compact to the default representation (see labels), as total_flow
+        and aggregate_countries expect."""
+        self.data = self.labels()
+        self.compact = False
+
+    def compact_country_names(self):
+        """Function to return the country codes table with integer codes and categorical names and ISO3, for the compact mode."""
+        df = self.country_names[['country_code', 'country_name_abbreviation', 'iso_3digit_alpha']].copy()
+        df['country_code'] = pd.to_numeric(df['country_code']).astype('int32')
+        return df.astype({'country_name_abbreviation': 'category', 'iso_3digit_alpha': 'category'})
+
+    def labels(self):
+        """Function to return self.data with the labels of the default mode: string country codes, zero-padded
+        product codes, object names, ISO3 and trade flow, int32 year and float64 value and quantity. Without the compact
+        mode self.data is returned as is.
+
+        Returns:
+            pd.DataFrame: the labeled flows.
+        """
+        if not self.compact:
+            return self.data
+        df = self.data.copy()
+        df['origin'] = df['origin'].astype(str)
+        df['destination'] = df['destination'].astype(str)
+        df['product_code'] = self.product_labels.reindex(df['product_code'].to_numpy()).to_numpy()
+        df = df.astype({'year': 'int32', 'value': 'float64', 'quantity': 'float64'})
+        for col in ['origin_name', 'destination_name', 'origin_iso3', 'destination_iso3', 'trade_flow']:
+            if col in df.columns:
+                df[col] = df[col].astype(object)
+        if 'chapters' in df.columns:
+            df['chapters'] = df['chapters'].astype('int32')
+        return df
 
+    @profiled('BACI.match_country_codes', rows = data_rows)
     def match_country_codes(self, subscript):
         """Function to merge BACI dataset with country names, based on country codes.
         The country codes are matched for origin or destination, depending on value passed as argument.
@@ -45,19 +123,82 @@ class BACI():
         Args:
             subscript (str): This argument accepts only "origin" or "destination" as values.
         """
-        self.data = self.data.merge(self.country_names, how = 'left', left_on = subscript, right_on = 'country_code')
-        self.data.drop(columns = ['country_code', 'country_name_full', 'iso_2digit_alpha'], inplace = True)
+        if self.compact:
+            self.data = self.data.merge(self.compact_country_names(), how = 'left', left_on = subscript, right_on = 'country_code')
+            self.data.drop(columns = ['country_code'], inplace = True)
+        else:
+            self.data = self.data.merge(self.country_names, how = 'left', left_on = subscript, right_on = 'country_code')
+            self.data.drop(columns = ['country_code', 'country_name_full', 'iso_2digit_alpha'], inplace = True)
         self.data.rename(columns = {'country_name_abbreviation': f'{subscript}_name', 'iso_3digit_alpha': f'{subscript}_iso3'}, inplace = True)
 
+    @staticmethod
+    def country_lookup(df_country_codes, column):
+        """Function to build a lookup table from numeric country code to a column of the country codes table.
+        Position n of the table holds the position in the categories of the value of code n, or -1 for unknown codes.
+
+        Args:
+            df_country_codes (pd.DataFrame): BACI country codes.
+            column (str): column to look up, e.g. "country_name_abbreviation".
+
+        Returns:
+            tuple: the lookup array and the categories it indexes into.
+        """
+        codes = pd.to_numeric(df_country_codes['country_code']).to_numpy().astype('int64')
+        values, categories = pd.factorize(df_country_codes[column])
+        lookup = np.full(codes.max() + 1 if len(codes) else 0, -1, dtype = 'int32')
+        lookup[codes] = values
+        return lookup, categories
+
+    @profiled('BACI.resolve_country_codes', rows = data_rows)
+    def resolve_country_codes(self, subscripts = ("origin", "destination")):
+        """Function to add the name and ISO3 of the countries of self.data, based on their numeric codes.
+        This gives the columns of match_country_codes, but through lookup tables: the codes are not merged with
+        the country codes table and the rows of self.data are not copied. Unknown codes get missing values.
+
+        Args:
+            subscripts (iterable): "origin", "destination" or both.
+        """
+        lookups = {label: BACI.country_lookup(self.country_names, column) for label, column in [('name', 'country_name_abbreviation'), ('iso3', 'iso_3digit_alpha')]}
+        for subscript in subscripts:
+            codes = self.data[subscript].to_numpy()
+            if not self.compact:
+                codes = pd.to_numeric(self.data[subscript], errors = 'coerce').fillna(-1).to_numpy()
+            codes = codes.astype('int64')
+            for label, (lookup, categories) in lookups.items():
+                found = (codes >= 0) & (codes < len(lookup))
+                category_codes = np.where(found, lookup[np.where(found, codes, 0)], -1)
+                if self.compact:
+                    self.data[f'{subscript}_{label}'] = pd.Categorical.from_codes(category_codes, categories = categories)
+                else:
+                    self.data[f'{subscript}_{label}'] = np.append(np.asarray(categories, dtype = object), np.nan)[category_codes]
+
+    @profiled('BACI.slice_reporter', rows = data_rows)
+    def slice_reporter(self, reporter):
+        """Function to keep the flows of a reporter, as slice_countries("or", ...) on its ISO3 code, but comparing the
+        numeric codes so that it can run before the names are resolved.
+
+        Args:
+            reporter (str): ISO3 code of the reporter, e.g. "KOR".
+        """
+        codes = self.country_names.loc[self.country_names['iso_3digit_alpha'] == reporter, 'country_code']
+        codes = pd.to_numeric(codes).astype('int32').tolist() if self.compact else codes.astype(str).tolist()
+        self.data = self.data[(self.data['origin'].isin(codes) | self.data['destination'].isin(codes)).to_numpy()]
+
+    @profiled('BACI.trade_flow_class', rows = data_rows)
     def trade_flow_class(self, dict_filters):
-        self.data['trade_flow'] = ''
+        flow_codes = np.zeros(len(self.data), dtype = 'int8')
         for arg in dict_filters:
             if 'origin' in arg:
                 flow = 'Export'
             elif 'destination' in arg:
                 flow = 'Import'
-            self.data.at[self.data[arg] == dict_filters[arg], 'trade_flow'] = flow
+            flow_codes[(self.data[arg] == dict_filters[arg]).to_numpy()] = BACI.flow_categories.index(flow)
+        if self.compact:
+            self.data['trade_flow'] = pd.Categorical.from_codes(flow_codes, categories = BACI.flow_categories)
+        else:
+            self.data['trade_flow'] = np.array(BACI.flow_categories, dtype = object)[flow_codes]
     
+    @profiled('BACI.slice_countries', rows = data_rows)
     def slice_countries(self, subscript, dict_filters):
         col_names = list(dict_filters.keys())
         try:
@@ -70,39 +211,140 @@ class BACI():
         except Exception as e:
             self.log.info(f'{e}')
     
+    @staticmethod
+    def factorize_keys(df, columns):
+        """Function to code the values of key columns as integers that sort like the values.
+        Missing values get one more code than the values of their column.
+
+        Args:
+            df (pd.DataFrame): the dataframe with the keys.
+            columns (list): names of the key columns.
+
+        Returns:
+            tuple: the codes of every column, the sorted values of every column and the number of codes of every column.
+        """
+        codes, uniques = [], []
+        for col in columns:
+            col_codes, col_uniques = pd.factorize(df[col], sort = True)
+            codes.append(np.where(col_codes < 0, len(col_uniques), col_codes).astype('int64'))
+            uniques.append(col_uniques)
+        return codes, uniques, [len(col_uniques) + 1 for col_uniques in uniques]
+
+    @staticmethod
+    def group_sums(keys, columns):
+        """Function to sum columns by integer key in a single pass.
+
+        Args:
+            keys (np.ndarray): one integer key per row.
+            columns (dict): arrays to sum, one value per row. Missing values count as 0, as in a groupby sum.
+
+        Returns:
+            tuple: the sorted distinct keys, the position of the first row of every key and the sums of every column.
+        """
+        groups, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+        sums = {col: np.bincount(inverse.ravel(), weights = np.nan_to_num(values.astype('float64')), minlength = len(groups)) for col, values in columns.items()}
+        return groups, first, sums
+
+    @profiled('BACI.total_flow', rows = data_rows)
     def total_flow(self):
-        raw_df = self.data.copy()
-        temp_df = raw_df.copy()
-        temp_df = temp_df.groupby(['year', 'origin_name', 'destination_name'], as_index = False).agg({"value": "sum", "origin": "first", "destination": "first",
-                                                                                                      "quantity": "sum", "origin_iso3": "first", "destination_iso3": "first", "trade_flow": "first"})
-        temp_df['product_code'] = 'total'
-        temp_df['chapters'] = ''
-        temp_df['industry'] = ''
-        self.data = self.data.append(temp_df, ignore_index = True)
-        temp_df = raw_df.copy()
-        temp_df = temp_df.groupby(['year', 'origin_name', 'destination_name', 'chapters'], as_index = False).agg({"value": "sum", "origin": "first", "destination": "first",
-                                                                                                      "quantity": "sum", "origin_iso3": "first", "destination_iso3": "first", "trade_flow": "first"})
-        temp_df['product_code'] = temp_df['chapters']
-        temp_df['industry'] = ''
-        self.data = self.data.append(temp_df, ignore_index = True)
-        temp_df = raw_df.copy()
-        temp_df = temp_df.groupby(['year', 'origin_name', 'destination_name', 'industry'], as_index = False).agg({"value": "sum", "origin": "first", "destination": "first",
-                                                                                                      "quantity": "sum", "origin_iso3": "first", "destination_iso3": "first", "trade_flow": "first"})
-        temp_df['product_code'] = temp_df['industry']
-        temp_df['chapters'] = ''
-        self.data = self.data.append(temp_df, ignore_index = True)
-    
+        """Function to add the trade of every pair of countries in total ("total"), by HS chapter and by industry.
+        The value and quantity are summed once by year, pair, chapter and industry on integer-coded keys, the three
+        levels are rolled up from those sums and appended with a single concat. The codes, ISO3 and trade flow of
+        a level row are the ones of the first row of its pair, as they do not change within a pair.
+        """
+        keys = ['year', 'origin_name', 'destination_name', 'chapters', 'industry']
+        codes, uniques, sizes = BACI.factorize_keys(self.data, keys)
+        finest, first, sums = BACI.group_sums(np.ravel_multi_index(codes, sizes), {'value': self.data['value'].to_numpy(), 'quantity': self.data['quantity'].to_numpy()})
+        finest_codes = np.unravel_index(finest, sizes)
+        levels = []
+        for level, product_code, empty in [([], None, ['chapters', 'industry']), (['chapters'], 'chapters', ['industry']), (['industry'], 'industry', ['chapters'])]:
+            positions = [0, 1, 2] + [keys.index(col) for col in level]
+            # Groups with a missing key are left out of the level, as groupby does
+            valid = np.logical_and.reduce([finest_codes[i] < len(uniques[i]) for i in positions])
+            groups, first_group, level_sums = BACI.group_sums(np.ravel_multi_index([finest_codes[i][valid] for i in positions], [sizes[i] for i in positions]),
+                                                              {col: values[valid] for col, values in sums.items()})
+            rows = first[valid][first_group]
+            group_codes = np.unravel_index(groups, [sizes[i] for i in positions])
+            temp_df = pd.DataFrame({keys[i]: uniques[i].take(col_codes) for i, col_codes in zip(positions, group_codes)})
+            temp_df['value'] = level_sums['value']
+            temp_df['quantity'] = level_sums['quantity']
+            for col in ['origin', 'destination', 'origin_iso3', 'destination_iso3', 'trade_flow']:
+                temp_df[col] = self.data[col].to_numpy()[rows]
+            temp_df['product_code'] = 'total' if product_code is None else temp_df[product_code]
+            for col in empty:
+                temp_df[col] = ''
+            levels.append(temp_df)
+        self.data = pd.concat([self.data] + levels, ignore_index = True)
+
+    @profiled('BACI.aggregate_countries', rows = data_rows)
+    def aggregate_countries(self, groups):
+        """Function to add the trade of the reporter with groups of countries, by year, product and trade flow.
+        A row belongs to a group when its partner (origin for imports, destination for exports) is in the group;
+        a row can belong to several groups. All the groups are summed in a single pass and appended with a single concat.
+
+        Args:
+            groups (dict): name of the group as keys, (list of country names, country code of the group) as values,
+                e.g. {"EU28": (BACI.eu28, "0"), "USMCA": (BACI.usmca, "2")}.
+        """
+        if not groups:
+            return
+        keys = ['year', 'product_code', 'trade_flow']
+        codes, uniques, sizes = BACI.factorize_keys(self.data, keys)
+        row_keys = np.ravel_multi_index(codes, sizes)
+        n_keys = int(np.prod(sizes))
+        is_import = (self.data['trade_flow'] == 'Import').to_numpy()
+        is_export = (self.data['trade_flow'] == 'Export').to_numpy()
+        origin_codes, origin_names = pd.factorize(self.data['origin_name'])
+        destination_codes, destination_names = pd.factorize(self.data['destination_name'])
+        member_rows = []
+        for position, (countries, code) in enumerate(groups.values()):
+            # Membership is looked up once per distinct name; the last slot is for missing names (code -1)
+            in_origin = np.append(np.isin(np.asarray(origin_names, dtype = object), countries), False)[origin_codes]
+            in_destination = np.append(np.isin(np.asarray(destination_names, dtype = object), countries), False)[destination_codes]
+            member_rows.append(np.flatnonzero((is_import & in_origin) | (is_export & in_destination)))
+        group_ids = np.concatenate([np.full(len(rows), position, dtype = 'int64') for position, rows in enumerate(member_rows)])
+        rows = np.concatenate(member_rows).astype('int64')
+        keys_found, first, sums = BACI.group_sums(group_ids * n_keys + row_keys[rows],
+                                                 {col: self.data[col].to_numpy()[rows] for col in ['value', 'quantity']})
+        valid = np.logical_and.reduce([key_codes < len(col_uniques) for key_codes, col_uniques in zip(np.unravel_index(keys_found % n_keys, sizes), uniques)])
+        keys_found, first = keys_found[valid], rows[first[valid]]
+        temp_df = pd.DataFrame({col: col_uniques.take(key_codes) for col, col_uniques, key_codes in zip(keys, uniques, np.unravel_index(keys_found % n_keys, sizes))})
+        temp_df['value'] = sums['value'][valid]
+        temp_df['quantity'] = sums['quantity'][valid]
+        for col in ['origin', 'destination', 'destination_name', 'origin_name', 'origin_iso3', 'destination_iso3']:
+            temp_df[col] = self.data[col].to_numpy()[first]
+        group_position = keys_found // n_keys
+        names = np.array(list(groups.keys()), dtype = object)[group_position]
+        group_codes = np.array([code for countries, code in groups.values()], dtype = object)[group_position]
+        for flow, side in [("Import", "origin"), ("Export", "destination")]:
+            mask = (temp_df["trade_flow"] == flow).to_numpy()
+            temp_df.loc[mask, f"{side}_name"] = names[mask]
+            temp_df.loc[mask, side] = group_codes[mask]
+            temp_df.loc[mask, f"{side}_iso3"] = names[mask]
+        self.data = pd.concat([self.data, temp_df], ignore_index = True)
+
     def aggregate_country(self, country_list, country_name, country_code):
-        temp_df = self.data.copy()
-        temp_df = temp_df[(temp_df['origin_name'].isin(country_list)) | (temp_df['destination_name'].isin(country_list))]
-        temp_df = temp_df.groupby(['year', 'product_code', 'trade_flow'], as_index = False).agg({"value": "sum", "origin": "first", "destination": "first", "destination_name": 'first', "origin_name": 'first',
-                                                                                                    "quantity": "sum", "origin_iso3": "first", "destination_iso3": "first", "trade_flow": "first"})
-        for flow in [("Import", "origin"), ("Export", "destination")]:
-            temp_df.at[temp_df["trade_flow"] == flow[0], f"{flow[1]}_name"] = country_name
-            temp_df.at[temp_df["trade_flow"] == flow[0], f"{flow[1]}"] = country_code
-            temp_df.at[temp_df["trade_flow"] == flow[0], f"{flow[1]}_iso3"] = country_name
-        self.data = self.data.append(temp_df, ignore_index = True)
-    
+        self.aggregate_countries({country_name: (country_list, country_code)})
+
+    @staticmethod
+    def industry_lookup(dictionary):
+        """Function to build a lookup table from HS chapter to industry.
+        Position n of the table holds the category code of chapter n; chapters outside every range
+        are mapped to the empty label. As in match_industry, later ranges win on overlaps.
+
+        Args:
+            dictionary (dict): industry names as keys, [first chapter, last chapter] as values.
+
+        Returns:
+            tuple: the lookup array and the list of categories it indexes into.
+        """
+        categories = list(dictionary.keys()) + ['']
+        size = max([100] + [chapter[1] + 1 for chapter in dictionary.values()])
+        lookup = np.full(size, len(categories) - 1, dtype = 'int16')
+        for position, chapter in enumerate(dictionary.values()):
+            lookup[chapter[0]:chapter[1] + 1] = position
+        return lookup, categories
+
     @staticmethod
     def match_industry(row, dictionary):
         for industry, chapter in dictionary.items():
@@ -110,9 +352,21 @@ class BACI():
                 row["industry"] = industry
         return row
     
-    def industry_classification(self):
-        self.data["chapters"] = self.data["product_code"].str[:2]
-        self.data = self.data.astype({'chapters': 'int32'})
-        self.data["industry"] = ""
-        self.data = self.data.apply(BACI.match_industry, dictionary = BACI.dict_industries, axis = 1)
-        
\ No newline at end of file
+    @profiled('BACI.industry_classification', rows = data_rows)
+    def industry_classification(self, dictionary = None):
+        """Function to classify every product in an industry, based on its HS chapter.
+        The classification is a single lookup in the table built by industry_lookup, and the
+        resulting "industry" column is categorical.
+
+        Args:
+            dictionary (dict, optional): industry map to use. Defaults to BACI.dict_industries.
+        """
+        if dictionary is None:
+            dictionary = BACI.dict_industries
+        if self.compact:
+            self.data["chapters"] = (self.data["product_code"] // 10000).astype('int8')
+        else:
+            self.data["chapters"] = self.data["product_code"].str[:2]
+            self.data = self.data.astype({'chapters': 'int32'})
+        lookup, categories = BACI.industry_lookup(dictionary)
+        self.data["industry"] = pd.Categorical.from_codes(lookup[self.data["chapters"].to_numpy()], categories = categories)
@@ -0,0 +1,99 @@
+"""Derived series of the aggregated BACI flows and the share files served by the app.
+
+derive_metrics adds every derived column to flows of any number of years in one pass over
+integer-coded keys; derive_year works one year at a time: total_trade and total_percentage
+only depend on the year itself, value_change and value_growth on the year and the previous one.
+"""
+import numpy as np
+import pandas as pd
+
+from class_data import BACI
+
+FLOW_KEYS = ['origin_name', 'destination_name', 'product_code']
+SHARE_KEYS = ['year', 'origin_name', 'destination_name']
+TOTAL_KEYS = ['year', 'product_code', 'trade_flow']
+
+
+def derive_metrics(df):
+    """Function to add total_trade, value_change, value_growth, value_log and total_percentage to aggregated flows
+    (the output of total_flow and aggregate_countries) of one or more years.
+    The keys are coded as integers once: total_trade is a bincount by year, product and trade flow, and the value of
+    the previous year is found with a single sort and search on (flow, year) codes.
+
+    value_change is the difference with the value of the same flow (origin, destination, product) in the previous
+    calendar year, missing when the flow has no row that year (the notebooks' groupby diff took the previous row
+    instead, whatever its year); when a flow has several rows in a year, the last one counts.
+    value_growth is value_change over the value of the previous year, as value_change / (value - value_change) in old_app.
+
+    Args:
+        df (pd.DataFrame): aggregated flows.
+
+    Returns:
+        pd.DataFrame: a copy of the flows with the five derived columns.
+    """
+    df = df.copy()
+    value = df['value'].to_numpy(dtype = 'float64')
+    codes, uniques, sizes = BACI.factorize_keys(df, TOTAL_KEYS)
+    total_keys = np.ravel_multi_index(codes, sizes)
+    _, inverse = np.unique(total_keys, return_inverse = True)
+    total_trade = np.bincount(inverse.ravel(), weights = np.nan_to_num(value))[inverse.ravel()]
+    # Rows with a missing key are left out of the sums, as groupby does
+    missing = np.logical_or.reduce([col_codes == len(col_uniques) for col_codes, col_uniques in zip(codes, uniques)])
+    total_trade[missing] = np.nan
+
+    codes, _, sizes = BACI.factorize_keys(df, FLOW_KEYS)
+    year = df['year'].to_numpy().astype('int64')
+    span = int(year.max() - year.min()) + 2 if len(year) else 1
+    # Year offsets start at 1, so the key of the previous year of a flow never falls into another flow
+    keys = np.ravel_multi_index(codes, sizes) * span + (year - year.min() + 1 if len(year) else year)
+    order = np.argsort(keys, kind = 'stable')
+    sorted_keys = keys[order]
+    last = np.flatnonzero(np.append(sorted_keys[1:] != sorted_keys[:-1], True))
+    last_keys, last_values = sorted_keys[last], value[order[last]]
+    position = np.minimum(np.searchsorted(last_keys, keys - 1), max(len(last_keys) - 1, 0))
+    previous = np.where((len(last_keys) > 0) & (last_keys[position] == keys - 1), last_values[position], np.nan) if len(keys) else value
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        df['total_trade'] = total_trade
+        df['value_change'] = value - previous
+        df['value_growth'] = (value - previous) / previous
+        df['value_log'] = np.log(value)
+        df['total_percentage'] = (value / total_trade) * 100
+    return df
+
+
+def derive_year(current, previous = None):
+    """Function to add the derived columns of derive_metrics to one year of aggregated flows.
+
+    Args:
+        current (pd.DataFrame): flows of the year.
+        previous (pd.DataFrame, optional): flows of the previous year. Without it value_change and value_growth are missing.
+
+    Returns:
+        pd.DataFrame: the flows of the year with the derived columns.
+    """
+    if previous is None:
+        return derive_metrics(current)
+    both = derive_metrics(pd.concat([previous, current], ignore_index = True))
+    return both.iloc[len(previous):].reset_index(drop = True)
+
+
+def share_table(df, flow, industries):
+    """Function to build the share file of a reporter for one trade flow, as served by the app: one row per partner
+    and industry with the share of the partner in the total trade (export_share) and in the trade of the industry
+    (export_share_ind), in percent.
+
+    Args:
+        df (pd.DataFrame): flows with total_percentage, from derive_year.
+        flow (str): "Import" or "Export".
+        industries (iterable): names of the industries, as in the product_code of the industry rows.
+
+    Returns:
+        pd.DataFrame: the share rows.
+    """
+    rows = df[df['trade_flow'] == flow]
+    total = rows.loc[rows['product_code'] == 'total', SHARE_KEYS + ['total_percentage']].rename(columns = {'total_percentage': 'export_share'})
+    industry = rows.loc[rows['product_code'].isin(list(industries)), SHARE_KEYS + ['product_code', 'total_percentage']]
+    industry = industry.rename(columns = {'product_code': 'industry', 'total_percentage': 'export_share_ind'})
+    shares = industry.merge(total, how = 'left', on = SHARE_KEYS)
+    return shares[SHARE_KEYS + ['industry', 'export_share', 'export_share_ind']]
@@ -0,0 +1,160 @@
+"""Bounded LRU cache of serialized Plotly figures for the app callbacks.
+
+The figure JSON is stored under a key built from the normalized callback inputs. Two backends
+are available: an in-process dictionary, and a SQLite file that every gunicorn worker on the
+machine reads and fills. Both evict the least recently used figures once the stored JSON
+exceeds the byte budget, and count the hits, misses and evictions where the figures are: per
+process in memory, for all the workers in the SQLite file.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+
+
+class MemoryBackend():
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            self.counters['misses' if value is None else 'hits'] += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key and return the number of evicted entries."""
+        evicted = 0
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last = False)
+                self.size -= len(old)
+                evicted += 1
+            self.counters['evictions'] += evicted
+        return evicted
+
+    def counts(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def nbytes(self):
+        return self.size
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DiskBackend():
+    """SQLite backend shared by the processes that open the same file. Every thread gets its own connection."""
+
+    def __init__(self, path, max_bytes):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        with self.connection() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS figures (key TEXT PRIMARY KEY, value TEXT, size INTEGER, used REAL)")
+            con.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            con.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [('hits',), ('misses',), ('evictions',)])
+
+    def connection(self):
+        if getattr(self.local, 'con', None) is None:
+            self.local.con = sqlite3.connect(str(self.path), timeout = 30)
+            self.local.con.execute("PRAGMA journal_mode=WAL")
+        return self.local.con
+
+    def get(self, key):
+        con = self.connection()
+        row = con.execute("SELECT value FROM figures WHERE key = ?", (key,)).fetchone()
+        with con:
+            con.execute("UPDATE counters SET value = value + 1 WHERE name = ?", ('misses' if row is None else 'hits',))
+            if row is not None:
+                con.execute("UPDATE figures SET used = ? WHERE key = ?", (time.time(), key))
+        return None if row is None else row[0]
+
+    def put(self, key, value):
+        """Store value under key and return the number of evicted entries."""
+        con = self.connection()
+        with con:
+            con.execute("INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+            excess = con.execute("SELECT SUM(size) FROM figures").fetchone()[0] - self.max_bytes
+            evict = []
+            if excess > 0:
+                for old_key, size in con.execute("SELECT key, size FROM figures WHERE key != ? ORDER BY used", (key,)):
+                    evict.append((old_key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                con.executemany("DELETE FROM figures WHERE key = ?", evict)
+                con.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'", (len(evict),))
+        return len(evict)
+
+    def counts(self):
+        return dict(self.connection().execute("SELECT name, value FROM counters"))
+
+    def nbytes(self):
+        return self.connection().execute("SELECT COALESCE(SUM(size), 0) FROM figures").fetchone()[0]
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM figures").fetchone()[0]
+
+
+class FigureCache():
+    """Cache of figure JSON keyed on the callback inputs.
+
+    Args:
+        backend (MemoryBackend or DiskBackend): where the figures are stored.
+        version (str): identifies the served data; figures cached for another version are never returned.
+    """
+
+    def __init__(self, backend, version = ''):
+        self.backend = backend
+        self.version = version
+
+    def key(self, inputs, version = None):
+        return json.dumps([self.version if version is None else version] + list(inputs))
+
+    def get_or_build(self, inputs, build, version = None):
+        """Return the JSON of the figure for inputs, calling build(*inputs) to make it on a miss.
+
+        Args:
+            inputs (tuple): normalized callback inputs.
+            build (function): returns a plotly figure for the inputs, or any JSON serializable data (e.g. the series
+                of plots_layout.share_series).
+            version (str, optional): version of the data behind this figure, in place of the version of the cache.
+
+        Returns:
+            str: the figure serialized to JSON.
+        """
+        key = self.key(inputs, version)
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+        value = build(*inputs)
+        value = value.to_json() if hasattr(value, 'to_json') else json.dumps(value)
+        self.backend.put(key, value)
+        return value
+
+    def warm(self, all_inputs, build, version = None):
+        """Build and store the figures for every tuple of inputs that is not cached yet."""
+        for inputs in all_inputs:
+            self.get_or_build(inputs, build, version)
+
+    def stats(self):
+        """Return the counters of the backend (of this process for MemoryBackend, of all the processes sharing the
+        file for DiskBackend), the number of figures and their bytes."""
+        return dict(self.backend.counts(), entries = len(self.backend), bytes = self.backend.nbytes())
@@ -0,0 +1,171 @@
+"""Incremental update of the data of a reporter when BACI publishes or revises some years.
+
+Every stage keeps one partition per year in the work folder:
+    partitions/  cleaned flows of the reporter (ingestion.clean_year)
+    aggregated/  with the total, chapter and industry levels and the country groups
+    derived/     with total_trade, value_change, value_growth, value_log and total_percentage
+A manifest per reporter (manifest_kor.json) records the content hash of the BACI file and of
+the country codes behind every year, so that the reporters can share the work folder. An update
+rebuilds only the years whose inputs changed, then recomputes the derived series of those years
+and of the year after each of them (value_change looks one year back), and finally patches the
+served share files and their columnar store, and the query store of the flows when one is given.
+
+Usage: python incremental.py KOR 2007 2019 --input <BACI folder> --codes <country codes file> --work temp/ --served data/ [--query data/baci.sqlite]
+"""
+import argparse
+import json
+import os
+import time
+
+from class_data import *
+from derived import derive_year, share_table
+from ingestion import BACI_FILE, READ_DTYPES, ingest, load_country_codes, partition_path
+from query_store import QueryStore
+from trade_store import build_dataset, file_digest
+
+DEFAULT_GROUPS = {name: BACI.country_groups[name] for name in ['EU28', 'EU27']}
+
+
+def manifest_path(work_path, reporter):
+    return Path(work_path) / f'manifest_{reporter.lower()}.json'
+
+
+def read_manifest(work_path, reporter):
+    """Return the manifest of a reporter, empty before its first update."""
+    try:
+        with open(manifest_path(work_path, reporter)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'years': {}, 'runs': []}
+
+
+def write_manifest(work_path, reporter, manifest):
+    path = manifest_path(work_path, reporter)
+    temp_file = path.with_suffix('.tmp')
+    with open(temp_file, 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(temp_file, path)
+
+
+def stale_years(manifest, years, reporter, input_path, work_path, codes_digest):
+    """Function to find the years whose partitions must be rebuilt.
+
+    Returns:
+        tuple: the reason of the rebuild of every stale year, and the digest of the BACI file of every year.
+    """
+    digests, reasons = {}, {}
+    for year in years:
+        digests[year] = file_digest(Path(input_path) / BACI_FILE.format(year = year))
+        entry = manifest['years'].get(str(year))
+        if entry is None:
+            reasons[year] = 'new year'
+        elif entry['input_digest'] != digests[year]:
+            reasons[year] = 'BACI file changed'
+        elif entry['codes_digest'] != codes_digest:
+            reasons[year] = 'country codes changed'
+        elif not (partition_path(Path(work_path) / 'aggregated', reporter, year).exists() and partition_path(Path(work_path) / 'derived', reporter, year).exists()):
+            reasons[year] = 'partition missing'
+    return reasons, digests
+
+
+def aggregate_year(reporter, year, work_path, country_codes, groups):
+    """Function to add the total, chapter and industry levels and the country groups to one cleaned year, in the
+    order of the notebooks (total_flow, then the groups), and write the aggregated partition."""
+    baci = BACI(pd.read_csv(partition_path(Path(work_path) / 'partitions', reporter, year), dtype = READ_DTYPES), country_codes)
+    baci.total_flow()
+    baci.aggregate_countries(groups)
+    replace_csv(baci.data, partition_path(Path(work_path) / 'aggregated', reporter, year))
+
+
+def patch_served(reporter, years, work_path, served_path, industries):
+    """Function to replace the rows of some years in the share files of a reporter, and refresh their columnar store."""
+    derived = pd.concat([pd.read_csv(partition_path(Path(work_path) / 'derived', reporter, year), dtype = READ_DTYPES) for year in years],
+                        ignore_index = True)
+    for flow, name in [('Import', f'{reporter.lower()}_import'), ('Export', f'{reporter.lower()}_export')]:
+        served_file = Path(served_path) / f'{name}.csv'
+        new_rows = share_table(derived, flow, industries)
+        if served_file.exists():
+            served = pd.read_csv(served_file)
+            new_rows = pd.concat([served[~served['year'].isin(years)], new_rows], ignore_index = True)
+        replace_csv(new_rows.sort_values(by = 'year', kind = 'mergesort'), served_file)
+        build_dataset(served_file, Path(served_path) / 'store')
+
+
+def update(years, reporter, input_path, codes_file, work_path, served_path, groups = None, industries = None, workers = None, query_path = None):
+    """Function to bring the partitions and the share files of a reporter up to date with the BACI files.
+
+    Args:
+        years (iterable): years to serve.
+        reporter (str): ISO3 code of the reporter.
+        input_path (Path): folder with the BACI yearly files.
+        codes_file (Path): BACI country codes file.
+        work_path (Path): folder of the partitions and of the manifests.
+        served_path (Path): folder of the share files served by the app.
+        groups (dict, optional): country groups, as in BACI.aggregate_countries. Defaults to EU28 and EU27.
+        industries (iterable, optional): industry names. Defaults to the ones of BACI.dict_industries.
+        workers (int, optional): number of processes that clean the BACI files.
+        query_path (Path, optional): SQLite file of the query store, where the derived flows of the years recomputed are replaced.
+
+    Returns:
+        dict: the run recorded in the manifest, with the years rebuilt at every stage and why.
+    """
+    years = sorted(years)
+    groups = DEFAULT_GROUPS if groups is None else groups
+    industries = list(BACI.dict_industries) if industries is None else industries
+    work_path = Path(work_path)
+    for folder in ['partitions', 'aggregated', 'derived']:
+        (work_path / folder).mkdir(parents = True, exist_ok = True)
+    Path(served_path).mkdir(parents = True, exist_ok = True)
+    manifest = read_manifest(work_path, reporter)
+    codes_digest = file_digest(codes_file)
+    rebuilt, digests = stale_years(manifest, years, reporter, input_path, work_path, codes_digest)
+    country_codes = load_country_codes(codes_file)
+
+    if rebuilt:
+        ingest(list(rebuilt), reporter, input_path, work_path / 'partitions', country_codes, workers = workers)
+        for year in rebuilt:
+            aggregate_year(reporter, year, work_path, country_codes, groups)
+    # value_change of a year depends on the previous year
+    derived = dict(rebuilt)
+    for year in rebuilt:
+        if year + 1 in years and year + 1 not in rebuilt:
+            derived[year + 1] = f'previous year rebuilt ({rebuilt[year]})'
+    query_store = QueryStore(query_path) if query_path is not None else None
+    for year in sorted(derived):
+        current = pd.read_csv(partition_path(work_path / 'aggregated', reporter, year), dtype = READ_DTYPES)
+        previous_file = partition_path(work_path / 'aggregated', reporter, year - 1)
+        previous = pd.read_csv(previous_file, dtype = READ_DTYPES) if year - 1 in years and previous_file.exists() else None
+        derived_df = derive_year(current, previous)
+        replace_csv(derived_df, partition_path(work_path / 'derived', reporter, year))
+        if query_store is not None:
+            query_store.load(derived_df, reporter)
+    if query_store is not None and derived:
+        query_store.analyze()
+    if rebuilt:
+        patch_served(reporter, sorted(rebuilt), work_path, served_path, industries)
+
+    for year in rebuilt:
+        manifest['years'][str(year)] = {'reporter': reporter, 'input_digest': digests[year], 'codes_digest': codes_digest}
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'reporter': reporter,
+           'rebuilt': {str(year): reason for year, reason in rebuilt.items()},
+           'derived': {str(year): reason for year, reason in sorted(derived.items())},
+           'served_years_patched': [int(year) for year in sorted(rebuilt)]}
+    manifest['runs'].append(run)
+    write_manifest(work_path, reporter, manifest)
+    return run
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Update the partitions and the share files of a reporter with new or revised BACI years.")
+    parser.add_argument('reporter', help = "ISO3 code of the reporter, e.g. KOR")
+    parser.add_argument('first_year', type = int)
+    parser.add_argument('last_year', type = int)
+    parser.add_argument('--input', type = Path, required = True, help = "folder with the BACI yearly files")
+    parser.add_argument('--codes', type = Path, required = True, help = "BACI country codes file")
+    parser.add_argument('--work', type = Path, default = Path('temp/'))
+    parser.add_argument('--served', type = Path, default = Path('data/'))
+    parser.add_argument('--workers', type = int)
+    parser.add_argument('--query', type = Path, help = "SQLite file of the query store to update")
+    args = parser.parse_args()
+    print(json.dumps(update(range(args.first_year, args.last_year + 1), args.reporter, args.input, args.codes, args.work, args.served,
+                            workers = args.workers, query_path = args.query), indent = 2))
@@ -0,0 +1,122 @@
+"""Parallel, streaming ingestion of the yearly BACI files for one reporter.
+
+Every year is cleaned in its own process: the BACI file is read in chunks, only the flows
+of the reporter are kept before matching the country codes, and the cleaned year is written
+as its own partition (e.g. temp/kor_2018.csv). Peak memory depends on the chunk size and on
+the flows of the reporter, not on the size of the BACI files.
+
+Usage: python ingestion.py KOR 2007 2018 --input <BACI folder> --codes <country codes file> --output temp/
+"""
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+
+from class_data import *
+
+BACI_FILE = "BACI_HS07_Y{year}_V202001.csv"
+CHUNKSIZE = 1000000
+READ_DTYPES = {'product_code': 'str', 'origin': 'str', 'destination': 'str'}
+
+
+def load_country_codes(path):
+    """Function to read the BACI country codes file."""
+    return pd.read_csv(path, encoding = 'latin-1', dtype = {'country_code': 'str', 'country_name_abbreviation': 'str', 'country_name_full': 'str',
+                                                           'iso_2digit_alpha': 'str', 'iso_3digit_alpha': 'str'})
+
+
+def reporter_codes(country_codes, reporter):
+    """Return the numeric BACI codes of a reporter ISO3 code (some countries have more than one)."""
+    codes = country_codes.loc[country_codes['iso_3digit_alpha'] == reporter, 'country_code']
+    if codes.empty:
+        raise ValueError(f"{reporter} is not in the country codes")
+    return [int(code) for code in codes]
+
+
+def partition_path(output_path, reporter, year):
+    return Path(output_path) / f"{reporter.lower()}_{year}.csv"
+
+
+def read_reporter_flows(file, codes, chunksize = CHUNKSIZE):
+    """Function to read the flows of a BACI file where the reporter is origin or destination, one chunk at a time.
+
+    Args:
+        file (Path): BACI yearly file.
+        codes (list): numeric codes of the reporter.
+        chunksize (int): number of rows read at once.
+
+    Returns:
+        pd.DataFrame: the flows of the reporter, with the raw BACI columns.
+    """
+    parts = []
+    for chunk in pd.read_csv(file, chunksize = chunksize):
+        parts.append(chunk[chunk['i'].isin(codes) | chunk['j'].isin(codes)])
+    return pd.concat(parts, ignore_index = True)
+
+
+def clean_year(year, reporter, input_path, output_path, country_codes, chunksize = CHUNKSIZE):
+    """Function to clean one BACI year for a reporter and write it as a partition.
+    The steps are the ones of the cleaning_baci loop in the notebooks, applied to the flows of the reporter only;
+    the country codes are resolved with lookup tables after the flows of the reporter are kept.
+
+    Args:
+        year (int): year of the BACI file.
+        reporter (str): ISO3 code of the reporter, e.g. "KOR".
+        input_path (Path): folder with the BACI yearly files.
+        output_path (Path): folder of the partitions.
+        country_codes (pd.DataFrame): BACI country codes, as read by load_country_codes.
+        chunksize (int): number of rows read at once.
+
+    Returns:
+        Path: the partition written.
+    """
+    df = read_reporter_flows(Path(input_path) / BACI_FILE.format(year = year), reporter_codes(country_codes, reporter), chunksize)
+    baci = BACI(df, country_codes)
+    baci.adjust_columns()
+    baci.slice_reporter(reporter)
+    baci.resolve_country_codes()
+    baci.trade_flow_class({'origin_iso3': reporter, 'destination_iso3': reporter})
+    baci.industry_classification()
+    output_file = partition_path(output_path, reporter, year)
+    replace_csv(baci.data, output_file)
+    return output_file
+
+
+def ingest(years, reporter, input_path, output_path, country_codes, workers = None, chunksize = CHUNKSIZE):
+    """Function to clean several BACI years for a reporter in a pool of processes.
+
+    Args:
+        years (iterable): years to clean.
+        reporter (str): ISO3 code of the reporter.
+        input_path (Path): folder with the BACI yearly files.
+        output_path (Path): folder of the partitions.
+        country_codes (pd.DataFrame): BACI country codes.
+        workers (int, optional): number of processes. Defaults to the number of CPUs.
+        chunksize (int): number of rows read at once by every process.
+
+    Returns:
+        dict: the partition written for every year.
+    """
+    Path(output_path).mkdir(parents = True, exist_ok = True)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = {year: pool.submit(clean_year, year, reporter, input_path, output_path, country_codes, chunksize) for year in years}
+        return {year: future.result() for year, future in futures.items()}
+
+
+def read_partitions(output_path, reporter, years):
+    """Function to read the partitions of a reporter back into one dataframe."""
+    return pd.concat([pd.read_csv(partition_path(output_path, reporter, year), dtype = READ_DTYPES) for year in years], ignore_index = True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Clean the BACI yearly files of a reporter into per-year partitions.")
+    parser.add_argument('reporter', help = "ISO3 code of the reporter, e.g. KOR")
+    parser.add_argument('first_year', type = int)
+    parser.add_argument('last_year', type = int)
+    parser.add_argument('--input', type = Path, required = True, help = "folder with the BACI yearly files")
+    parser.add_argument('--codes', type = Path, required = True, help = "BACI country codes file")
+    parser.add_argument('--output', type = Path, default = Path('temp/'))
+    parser.add_argument('--workers', type = int)
+    parser.add_argument('--chunksize', type = int, default = CHUNKSIZE)
+    args = parser.parse_args()
+    ingest(range(args.first_year, args.last_year + 1), args.reporter, args.input, args.output, load_country_codes(args.codes),
+           args.workers, args.chunksize)
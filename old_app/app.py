@@ -1,3 +1,5 @@
+import os
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
@@ -6,6 +8,7 @@ from dash.dependencies import Input, Output
 from pathlib import Path
 
 from plots_layout import *
+from query_store import QueryStore
 
 app = dash.Dash(__name__)
 
@@ -16,20 +19,12 @@ server = app.server
 
 input_path = Path('data/')
 
-df = pd.DataFrame()
-
-for year in range(2007, 2019):
-    temp_df = pd.read_csv(input_path / f'slice_{year}.csv', dtype = {'product_code': 'str'})
-    temp_df['product_code'] = temp_df['product_code'].apply(lambda x: '0' + x if len(x) == 1 else x)
-    temp_df['product_code'] = temp_df['product_code'].apply(lambda x: '0' + x if len(x) == 5 and re.match(r'[0-9]{5}', x) else x)
-    temp_df['value_log'] = np.log(temp_df['value'])
-    temp_df['value_growth'] = temp_df['value_change']/(temp_df['value'] - temp_df['value_change'])
-    df = df.append(temp_df, ignore_index=True)
+# The flows are read from the query store (built by incremental.py --query or query_store.py) at every callback,
+# with the filters on partner and product done by SQLite, instead of being loaded in memory at startup
+store = QueryStore(os.environ.get('QUERY_STORE_PATH', str(input_path / 'baci.sqlite')))
+reporter = os.environ.get('REPORTER', 'KOR')
 
-importers = set(df['destination_name'].unique())
-exporters = set(df['origin_name'].unique())
-countries = list(importers.union(exporters))
-countries.sort()
+countries = store.partners(reporter)
 
 app.layout = html.Div([
     dcc.Dropdown(
@@ -73,8 +68,7 @@ app.layout = html.Div([
 def update_product_dropdown(country, classification):
     if len(country) == 0:
         country.append('EU28')
-    filtered_df = df[(df['origin_name'].isin(country)) | (df['destination_name'].isin(country))].copy()
-    product_dict = product_choice(filtered_df)
+    product_dict = product_choice(store.products(reporter, country))
     return [{'label': i, 'value': i} for i in product_dict[classification]]
 
 @app.callback(
@@ -85,8 +79,7 @@ def update_product_dropdown(country, classification):
 def update_line_chart(country, hs, plot_type):
     if len(country) == 0:
         country.append('EU28')
-    filtered_df = df[(df['origin_name'].isin(country)) | (df['destination_name'].isin(country))].copy()
-    filtered_df = filtered_df[filtered_df['product_code'] == hs]
+    filtered_df = store.flows(reporter, country, hs)   # value_log and value_growth are precomputed by derived.derive_metrics
     if len(country) == 1:
         fig = layout_single(filtered_df, plot_type)
         return fig
@@ -3,10 +3,15 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
+import json
 import re
 
+from itertools import repeat
+
 def product_choice(df):
-    products = list(set(df['product_code'].unique()))
+    """Function to sort the product codes of a dataframe, or a list of product codes (e.g. from QueryStore.products),
+    into 6-digit codes, 2-digit codes and industries."""
+    products = list(set(df['product_code'].unique() if isinstance(df, pd.DataFrame) else df))
     hs_codes = []
     hs_chapters = []
     industry = []
@@ -27,6 +32,25 @@ def product_choice(df):
     product_dict = {"6-digit codes": hs_codes, "2-digit codes": hs_chapters, "Industry": industry}
     return product_dict
 
+def hover_text(template, *columns):
+    """Format one hover string per row, filling the placeholders of template with the columns in order.
+    Plain iteration over the columns avoids building a Series per row as iloc does."""
+    return [template.format(*values) for values in zip(*columns)]
+
+def split_by(df, col, values):
+    """Function to split a dataframe into the rows of every value of col, with a single groupby.
+
+    Args:
+        df (pd.DataFrame): the dataframe to split.
+        col (str): the column to group by.
+        values (list): values of col to keep.
+
+    Returns:
+        dict: the rows of every value present in df, in their original order.
+    """
+    grouped = df[df[col].isin(values)].groupby(col, sort = False, observed = True)
+    return {key: group for key, group in grouped}
+
 def layout_single(df, plot_type):
     import_df = df[df['trade_flow'] == "Import"].copy()
     export_df = df[df['trade_flow'] == "Export"].copy()
@@ -36,13 +60,13 @@ def layout_single(df, plot_type):
     if plot_type == "Log":
         y_imp = import_df["value_log"]
         y_exp = export_df["value_log"]
-        text_imp = [f"Year: {import_df.iloc[indice]['year']} <br>Imports: {import_df.iloc[indice]['value']:,.2f} <br>Imports (log): {import_df.iloc[indice]['value_log']:,.2f}" for indice in range(len(import_df))]
-        text_exp = [f"Year: {export_df.iloc[indice]['year']} <br>Exports: {export_df.iloc[indice]['value']:,.2f} <br>Exports (log): {np.log(export_df.iloc[indice]['value']):,.2f}" for indice in range(len(export_df))]
+        text_imp = hover_text("Year: {} <br>Imports: {:,.2f} <br>Imports (log): {:,.2f}", import_df['year'], import_df['value'], import_df['value_log'])
+        text_exp = hover_text("Year: {} <br>Exports: {:,.2f} <br>Exports (log): {:,.2f}", export_df['year'], export_df['value'], np.log(export_df['value']))
     elif plot_type == "Growth rate":
         y_imp = import_df["value_growth"]
         y_exp = export_df["value_growth"]
-        text_imp = [f"Year: {import_df.iloc[indice]['year']} <br>Imports change: {import_df.iloc[indice]['value_change']:,.2f} <br>Imports (log change): {import_df.iloc[indice]['value_growth']:.2%}" for indice in range(len(import_df))]
-        text_exp = [f"Year: {export_df.iloc[indice]['year']} <br>Exports change: {export_df.iloc[indice]['value_change']:,.2f} <br>Exports (log change): {export_df.iloc[indice]['value_growth']:.2%}" for indice in range(len(export_df))]
+        text_imp = hover_text("Year: {} <br>Imports change: {:,.2f} <br>Imports (log change): {:.2%}", import_df['year'], import_df['value_change'], import_df['value_growth'])
+        text_exp = hover_text("Year: {} <br>Exports change: {:,.2f} <br>Exports (log change): {:.2%}", export_df['year'], export_df['value_change'], export_df['value_growth'])
     fig.add_trace(go.Scatter(x = x_imp, y = y_imp, mode = 'lines+markers', name = 'Imports',
                             hoverinfo = "text", hovertext = text_imp))
     fig.add_trace(go.Scatter(x = x_exp, y = y_exp, mode = 'lines+markers', name = 'Exports',
@@ -60,27 +84,29 @@ def layout_multi(df, country_list, plot_type):
     import_df = df[df['trade_flow'] == "Import"].copy()
     export_df = df[df['trade_flow'] == "Export"].copy()
     fig = make_subplots(rows=2, cols=1, subplot_titles = ("Imports", "Exports"), shared_xaxes = True, vertical_spacing = 0.2)
+    imp_by_country = split_by(import_df, 'origin_name', country_list)
+    exp_by_country = split_by(export_df, 'destination_name', country_list)
+    traces = []
     for country in country_list:
-        red_imp_df = import_df[import_df['origin_name'] == country].copy()
-        red_exp_df = export_df[export_df['destination_name'] == country].copy()
+        red_imp_df = imp_by_country.get(country, import_df.iloc[:0])
+        red_exp_df = exp_by_country.get(country, export_df.iloc[:0])
         x_imp = red_imp_df["year"]
         x_exp = red_exp_df["year"]
         if plot_type == "Log":
             y_imp = red_imp_df["value_log"]
             y_exp = red_exp_df["value_log"]
-            text_imp = [f"Year: {red_imp_df.iloc[indice]['year']} <br>Country: {country} <br>Imports: {red_imp_df.iloc[indice]['value']:,.2f} <br>Imports (log): {red_imp_df.iloc[indice]['value_log']:,.2f}" for indice in range(len(red_imp_df))]
-            text_exp = [f"Year: {red_exp_df.iloc[indice]['year']} <br>Country: {country} <br>Exports: {red_exp_df.iloc[indice]['value']:,.2f} <br>Exports (log): {red_exp_df.iloc[indice]['value_log']:,.2f}" for indice in range(len(red_exp_df))]
+            text_imp = hover_text("Year: {} <br>Country: {} <br>Imports: {:,.2f} <br>Imports (log): {:,.2f}", red_imp_df['year'], repeat(country), red_imp_df['value'], red_imp_df['value_log'])
+            text_exp = hover_text("Year: {} <br>Country: {} <br>Exports: {:,.2f} <br>Exports (log): {:,.2f}", red_exp_df['year'], repeat(country), red_exp_df['value'], red_exp_df['value_log'])
         elif plot_type == "Growth rate":
             y_imp = red_imp_df["value_growth"]
             y_exp = red_exp_df["value_growth"]
-            text_imp = [f"Year: {red_imp_df.iloc[indice]['year']} <br>Country: {country} <br>Imports change: {red_imp_df.iloc[indice]['value_change']:,.2f} <br>Imports (log change): {red_imp_df.iloc[indice]['value_growth']:.2%}" for indice in range(len(red_imp_df))]
-            text_exp = [f"Year: {red_exp_df.iloc[indice]['year']} <br>Country: {country} <br>Exports change: {red_exp_df.iloc[indice]['value_change']:,.2f} <br>Exports (log change): {red_exp_df.iloc[indice]['value_growth']:.2%}" for indice in range(len(red_exp_df))]
-        fig.add_trace(go.Scatter(x = x_imp, y = y_imp, mode = 'lines+markers', name = f"{country} - Imports",
-                                hoverinfo = "text", hovertext = text_imp),
-                       row = 1, col = 1)
-        fig.add_trace(go.Scatter(x = x_exp, y = y_exp, mode = 'lines+markers', name = f"{country} - Exports",
-                                hoverinfo = "text", hovertext = text_exp),
-                       row = 2, col = 1)
+            text_imp = hover_text("Year: {} <br>Country: {} <br>Imports change: {:,.2f} <br>Imports (log change): {:.2%}", red_imp_df['year'], repeat(country), red_imp_df['value_change'], red_imp_df['value_growth'])
+            text_exp = hover_text("Year: {} <br>Country: {} <br>Exports change: {:,.2f} <br>Exports (log change): {:.2%}", red_exp_df['year'], repeat(country), red_exp_df['value_change'], red_exp_df['value_growth'])
+        traces.append(go.Scatter(x = x_imp, y = y_imp, mode = 'lines+markers', name = f"{country} - Imports",
+                                hoverinfo = "text", hovertext = text_imp))
+        traces.append(go.Scatter(x = x_exp, y = y_exp, mode = 'lines+markers', name = f"{country} - Exports",
+                                hoverinfo = "text", hovertext = text_exp))
+    fig.add_traces(traces, rows = [1, 2] * len(country_list), cols = 1)
     fig.update_layout(plot_bgcolor = 'white', paper_bgcolor = 'white')
     fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='lightgrey')
     fig.update_xaxes(tickformat = 'Y')
@@ -90,46 +116,144 @@ def layout_multi(df, country_list, plot_type):
     fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='black')
     return fig
 
-def layout_share(mex_imp, mex_exp, kor_imp, kor_exp, industry, top):
-    for df, flow in [(mex_imp, 'mex_import'), (mex_exp, 'mex_export'), (kor_imp, 'kor_import'), (kor_exp, 'kor_export')]:
-        if industry == 'Total':
-            original_df = df[~df.duplicated(subset = ['year', 'origin_name', 'destination_name'])].copy()
-            original_df.sort_values(by = ['year', 'export_share'], ascending = False, inplace = True)
-            original_df['ranking'] = original_df.groupby('year')['export_share'].rank(method = 'dense', ascending = False)
-        else:
-            original_df = df[df['industry'] == industry].copy()
-            original_df.sort_values(by = ['year', 'export_share_ind'], ascending = False, inplace = True)
-            original_df['ranking'] = original_df.groupby('year')['export_share_ind'].rank(method = 'dense', ascending = False)
-        temp_df = original_df[(original_df['ranking'] <= top) & (original_df['year'] == 2018)].copy()
-        if flow == 'mex_import':
-            top_imp_mex = list(temp_df['origin_name'])
-            mex_imp = original_df.copy()
-        elif flow == 'mex_export':
-            top_exp_mex = list(temp_df['destination_name'])
-            mex_exp = original_df.copy()
-        if flow == 'kor_import':
-            top_imp_kor = list(temp_df['origin_name'])
-            kor_imp = original_df.copy()
-        elif flow == 'kor_export':
-            top_exp_kor = list(temp_df['destination_name'])
-            kor_exp = original_df.copy()
-    fig = make_subplots(rows=2, cols=2, subplot_titles = ("Korean Imports", " Korean Exports", "Mexican Imports", "Mexican exports"), shared_xaxes = True, vertical_spacing = 0.1, row_heights = [0.5, 0.5])
-    for countries, df, row, col_sub, col in [(top_imp_mex, mex_imp, 2, 1, 'origin_name'), (top_exp_mex, mex_exp, 2, 2, 'destination_name'), (top_imp_kor, kor_imp, 1, 1, 'origin_name'), (top_exp_kor, kor_exp, 1, 2, 'destination_name')]:
-        for country in countries:
-            df_plot = df[df[col] == country].copy()
-            x = df_plot['year'].copy()
-            if industry == 'Total':
-                y = df_plot['export_share'].copy()
-                text = [f"Year: {df_plot.iloc[indice]['year']} <br>Country: {country} <br>Share: {df_plot.iloc[indice]['export_share']:,.2f} <br>Ranking: {df_plot.iloc[indice]['ranking']:,.2f}" for indice in range(len(df_plot))]
-            else:
-                y = df_plot['export_share_ind'].copy()
-                text = [f"Year: {df_plot.iloc[indice]['year']} <br>Country: {country} <br>Share: {df_plot.iloc[indice]['export_share_ind']:,.2f} <br>Ranking: {df_plot.iloc[indice]['ranking']:,.2f}" for indice in range(len(df_plot))]
-            fig.add_trace(go.Scatter(x = x, y = y, mode = 'lines+markers', name = f"{country}",
-                                    hoverinfo = "text", hovertext = text),
-                        row = row, col = col_sub)
-    fig.update_layout(plot_bgcolor = 'white', paper_bgcolor = 'white', height=1000)
+RANKING_YEAR = 2018
+
+def partner_column(flow):
+    """Return the column holding the trade partner of the reporter for flows named like "mex_import"."""
+    return 'origin_name' if flow.endswith('import') else 'destination_name'
+
+def rank_share(df, industry):
+    """Function to rank the partners of a share dataset in every year, for the total trade or one industry.
+
+    Args:
+        df (pd.DataFrame): share dataset of one reporter and flow.
+        industry (str): industry name, or "Total".
+
+    Returns:
+        pd.DataFrame: the rows of the industry sorted by year and share (descending), with a dense "ranking" column.
+    """
+    if industry == 'Total':
+        ranked_df = df[~df.duplicated(subset = ['year', 'origin_name', 'destination_name'])].copy()
+        share = 'export_share'
+    else:
+        ranked_df = df[df['industry'] == industry].copy()
+        share = 'export_share_ind'
+    ranked_df.sort_values(by = ['year', share], ascending = False, inplace = True)
+    ranked_df['ranking'] = ranked_df.groupby('year')[share].rank(method = 'dense', ascending = False)
+    return ranked_df
+
+def ranking_index(frames, industries, year = RANKING_YEAR):
+    """Function to rank every share dataset once for every industry, so that plotting the top partners
+    is a lookup instead of a sort and a rank per request.
+
+    Args:
+        frames (dict): share datasets keyed by flow name, e.g. "mex_import".
+        industries (iterable): industry names, "Total" included.
+        year (int): year whose ranking selects the top partners.
+
+    Returns:
+        dict: for every (flow, industry), the ranked rows ("data"), the partners of the year sorted
+        by ranking ("partners") and their rankings ("ranks").
+    """
+    index = {}
+    for flow, df in frames.items():
+        for industry in industries:
+            ranked_df = rank_share(df, industry)
+            year_df = ranked_df[ranked_df['year'] == year]
+            index[(flow, industry)] = {'data': ranked_df, 'partners': list(year_df[partner_column(flow)]),
+                                       'ranks': year_df['ranking'].to_numpy()}
+    return index
+
+def top_partners(entry, top):
+    """Return the partners ranked top or better in an entry of ranking_index."""
+    return entry['partners'][:np.searchsorted(entry['ranks'], top, side = 'right')]
+
+def layout_share(frames, industry, top, reporters, index = None, names = None):
+    """Function to plot the shares of the top partners of several reporters, one row of imports and exports per reporter.
+
+    Args:
+        frames (dict): share datasets keyed by flow name, e.g. "kor_import" and "kor_export".
+        industry (str): industry name, or "Total".
+        top (int): ranking (in RANKING_YEAR) of the last partner plotted.
+        reporters (list): reporter codes, in the order of the rows.
+        index (dict, optional): ranking_index of the datasets. Built for the industry when missing.
+        names (dict, optional): reporter code -> adjective used in the titles, e.g. {"kor": "Korean"}.
+
+    Returns:
+        go.Figure: the figure.
+    """
+    if index is None:
+        index = ranking_index({flow: frames[flow] for reporter in reporters for flow in [f'{reporter}_import', f'{reporter}_export']}, [industry])
+    names = {} if names is None else names
+    titles = [f"{names.get(reporter, reporter.upper())} {flow}" for reporter in reporters for flow in ["Imports", "Exports"]]
+    fig = make_subplots(rows=len(reporters), cols=2, subplot_titles = titles, shared_xaxes = True, vertical_spacing = 0.2 / len(reporters))
+    # The traces are added from the last row up, as the app did with Korea above Mexico: Plotly colours the traces
+    # and orders the legend by position, so the partners of the default reporters keep their colours
+    for row, reporter in reversed(list(enumerate(reporters, start = 1))):
+        for flow, col_sub in [(f'{reporter}_import', 1), (f'{reporter}_export', 2)]:
+            entry = index[(flow, industry)]
+            col = partner_column(flow)
+            share = 'export_share' if industry == 'Total' else 'export_share_ind'
+            countries = top_partners(entry, top)
+            by_country = split_by(entry['data'], col, countries)
+            traces = []
+            for country in countries:
+                df_plot = by_country[country]
+                x = df_plot['year'].to_numpy()
+                y = df_plot[share].to_numpy()
+                text = hover_text("Year: {} <br>Country: {} <br>Share: {:,.2f} <br>Ranking: {:,.2f}", x, repeat(country), y, df_plot['ranking'].to_numpy())
+                traces.append(go.Scatter(x = x, y = y, mode = 'lines+markers', name = f"{country}",
+                                        hoverinfo = "text", hovertext = text))
+            # One call per panel: every add_trace call re-validates the figure
+            fig.add_traces(traces, rows = row, cols = col_sub)
+    fig.update_layout(plot_bgcolor = 'white', paper_bgcolor = 'white', height=500 * len(reporters))
     fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='lightgrey')
     fig.update_xaxes(tickformat = 'Y')
     fig.update_yaxes(showgrid=False, gridwidth=1, gridcolor='lightgrey')
     fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='black')
     return fig
+
+def subplot_axes(row, col, cols = 2):
+    """Return the names of the x and y axes of a subplot of make_subplots, e.g. ("x3", "y3") for row 2, column 1."""
+    position = (row - 1) * cols + col
+    suffix = '' if position == 1 else str(position)
+    return f'x{suffix}', f'y{suffix}'
+
+def share_series(frames, industry, reporters, index = None, names = None):
+    """Function to gather, in a compact columnar form, everything the browser needs to draw layout_share for any top:
+    the layout of the figure and, for every panel, the ranked partners with their years, shares and rankings as flat
+    arrays (the points of partner i are offsets[i]:offsets[i + 1]). The traces are built by the clientside callback
+    share.top_figure (assets/share_clientside.js).
+
+    Args:
+        frames (dict): share datasets keyed by flow name, e.g. "kor_import" and "kor_export".
+        industry (str): industry name, or "Total".
+        reporters (list): reporter codes, in the order of the rows.
+        index (dict, optional): ranking_index of the datasets. Built for the industry when missing.
+        names (dict, optional): reporter code -> adjective used in the titles, e.g. {"kor": "Korean"}.
+
+    Returns:
+        dict: "layout" and "panels", serializable to JSON.
+    """
+    if index is None:
+        index = ranking_index({flow: frames[flow] for reporter in reporters for flow in [f'{reporter}_import', f'{reporter}_export']}, [industry])
+    share = 'export_share' if industry == 'Total' else 'export_share_ind'
+    panels = []
+    # In the order of the traces of layout_share, from the last row up
+    for row, reporter in reversed(list(enumerate(reporters, start = 1))):
+        for flow, col_sub in [(f'{reporter}_import', 1), (f'{reporter}_export', 2)]:
+            entry = index[(flow, industry)]
+            # Partners without a share in the ranking year are never plotted (NaN is past every top in top_partners)
+            ranked = ~np.isnan(entry['ranks'])
+            partners = [country for country, keep in zip(entry['partners'], ranked) if keep]
+            by_country = split_by(entry['data'], partner_column(flow), partners)
+            series = [by_country[country] for country in partners]
+            xaxis, yaxis = subplot_axes(row, col_sub)
+            panels.append({'xaxis': xaxis, 'yaxis': yaxis, 'partners': [str(country) for country in partners],
+                           'ranks': entry['ranks'][ranked].tolist(),
+                           'offsets': np.cumsum([0] + [len(df_plot) for df_plot in series]).tolist(),
+                           'year': [int(x) for df_plot in series for x in df_plot['year'].to_numpy()],
+                           'share': [float(y) for df_plot in series for y in df_plot[share].to_numpy()],
+                           'ranking': [float(r) for df_plot in series for r in df_plot['ranking'].to_numpy()]})
+    layout = json.loads(layout_share(frames, industry, 0, reporters, index = index, names = names).to_json())['layout']
+    return {'layout': layout, 'panels': panels}
@@ -0,0 +1,111 @@
+"""Timing and peak-memory metrics of the BACI stages and of the app callbacks.
+
+A stage is timed with the profiled decorator or the stage context manager of a StageMetrics.
+Every measurement is kept in memory for the /metrics summary and, when a path is set, appended
+as one JSON line to a file shared by the processes. The peak of traced memory is only measured
+when memory tracing is on, since tracemalloc slows the stages down; otherwise the peak resident
+memory of the process so far is recorded.
+
+The default metrics are configured by PROFILE_METRICS_PATH (JSON lines file, unset keeps them in
+memory only) and PROFILE_MEMORY=1 (trace the memory of every stage; the stages of concurrent
+callbacks then run one at a time).
+"""
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+
+class StageMetrics():
+    """Measurements of named stages.
+
+    Args:
+        path (Path, optional): JSON lines file the measurements are appended to.
+        trace_memory (bool): measure the peak of traced memory of every stage with tracemalloc.
+        max_records (int): number of recent measurements kept in memory.
+    """
+
+    def __init__(self, path = None, trace_memory = False, max_records = 10000):
+        self.path = Path(path) if path else None
+        self.trace_memory = trace_memory
+        self.records = deque(maxlen = max_records)
+        self.lock = threading.Lock()
+        # Reentrant: a stage nested in a traced stage of the same thread takes it again
+        self.trace_lock = threading.RLock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+
+    def record(self, stage, seconds, peak_mb = None, **fields):
+        record = dict({'time': time.time(), 'pid': os.getpid(), 'stage': stage, 'seconds': seconds, 'peak_mb': peak_mb,
+                       'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}, **fields)
+        with self.lock:
+            self.records.append(record)
+            if self.path is not None:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default = str) + '\n')
+        return record
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Time the block as stage name; the fields are added to its record. A stage nested in a traced stage
+        is timed but its peak is left to the outer stage. tracemalloc traces the whole process, so with memory
+        tracing the stages of different threads run one at a time, and their timings include the wait."""
+        with self.trace_lock if self.trace_memory else nullcontext():
+            trace = self.trace_memory and not tracemalloc.is_tracing()
+            if trace:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                yield fields
+            finally:
+                seconds = time.perf_counter() - start
+                peak_mb = None
+                if trace:
+                    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+                    tracemalloc.stop()
+                self.record(name, seconds, peak_mb, **fields)
+
+    def summary(self):
+        """Return the count, total, mean, p95 and max seconds and the max peak of every stage, from the records kept."""
+        stages = defaultdict(list)
+        with self.lock:
+            for record in self.records:
+                stages[record['stage']].append(record)
+        summary = {}
+        for stage, records in sorted(stages.items()):
+            seconds = sorted(record['seconds'] for record in records)
+            peaks = [record['peak_mb'] for record in records if record['peak_mb'] is not None]
+            summary[stage] = {'count': len(seconds), 'total_seconds': sum(seconds), 'mean_seconds': sum(seconds) / len(seconds),
+                              'p95_seconds': seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))], 'max_seconds': seconds[-1],
+                              'max_peak_mb': max(peaks) if peaks else None}
+        return summary
+
+
+metrics = StageMetrics(os.environ.get('PROFILE_METRICS_PATH') or None, trace_memory = os.environ.get('PROFILE_MEMORY', '0') == '1')
+
+
+def profiled(stage, rows = None):
+    """Decorator to record every call of a function as a stage of the default metrics.
+
+    Args:
+        stage (str): name of the stage.
+        rows (function, optional): called with the arguments of the function after the call, returns the number
+            of rows to record, e.g. lambda self, *args, **kwargs: len(self.data) for a BACI method.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(stage) as fields:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    fields['rows'] = rows(*args, **kwargs)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,143 @@
+"""Embedded SQLite store of the derived BACI flows of the reporters, queried by partner, product and year.
+
+The store holds every level of detail written by the incremental update (HS6 codes, chapters,
+industries, totals and country groups) with the derived columns, one row per flow. The partner
+of a flow is the origin of an import and the destination of an export, and the rows are indexed
+on (reporter, partner, product_code, year), so a callback reads only the rows it plots and the
+flows never have to be held in memory.
+
+Usage: python query_store.py KOR 2007 2018 --work temp/ --output data/baci.sqlite
+"""
+import argparse
+import sqlite3
+import threading
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ingestion import READ_DTYPES, partition_path
+
+COLUMNS = ['year', 'trade_flow', 'partner', 'origin_name', 'destination_name', 'product_code', 'value', 'quantity',
+           'value_change', 'value_growth', 'value_log', 'total_trade', 'total_percentage']
+NUMERIC_COLUMNS = ['value', 'quantity', 'value_change', 'value_growth', 'value_log', 'total_trade', 'total_percentage']
+
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def pad_product_codes(codes):
+    """Return the product codes as zero-padded strings, as product_choice offers them: total_flow writes the chapters
+    as integers ("1" for chapter 01), and a HS6 code read as a number loses its leading zero."""
+    codes = codes.astype(str)
+    return codes.mask(codes.str.fullmatch(r'[0-9]|[0-9]{5}'), '0' + codes)
+
+
+class QueryStore():
+    """SQLite file of derived flows. Every thread gets its own connection, as in figure_cache.DiskBackend.
+
+    Args:
+        path (Path): SQLite file, created when missing.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.local = threading.local()
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        with self.connection() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS flows (reporter TEXT, year INTEGER, trade_flow TEXT, partner TEXT, origin_name TEXT, "
+                        "destination_name TEXT, product_code TEXT, value REAL, quantity REAL, value_change REAL, value_growth REAL, value_log REAL, "
+                        "total_trade REAL, total_percentage REAL)")
+            con.execute("CREATE INDEX IF NOT EXISTS flows_partner ON flows (reporter, partner, product_code, year)")
+            con.execute("CREATE INDEX IF NOT EXISTS flows_product ON flows (reporter, product_code, year)")
+
+    def connection(self):
+        if getattr(self.local, 'con', None) is None:
+            self.local.con = sqlite3.connect(str(self.path), timeout = 30)
+            self.local.con.execute("PRAGMA journal_mode=WAL")
+        return self.local.con
+
+    def load(self, df, reporter):
+        """Function to replace the flows of a reporter in the years of df. Call analyze after the last load.
+
+        Args:
+            df (pd.DataFrame): derived flows, as written by derived.derive_year or derive_metrics.
+            reporter (str): ISO3 code of the reporter.
+        """
+        rows = df.reindex(columns = COLUMNS)
+        rows['partner'] = np.where(df['trade_flow'] == 'Import', df['origin_name'], df['destination_name'])
+        rows['year'] = rows['year'].astype('int64')
+        rows['product_code'] = pad_product_codes(rows['product_code'])
+        rows.insert(0, 'reporter', reporter)
+        years = [int(year) for year in rows['year'].unique()]
+        con = self.connection()
+        with con:
+            con.execute(f"DELETE FROM flows WHERE reporter = ? AND year IN ({placeholders(years)})", [reporter] + years)
+            con.executemany(f"INSERT INTO flows VALUES ({placeholders(rows.columns)})", rows.itertuples(index = False, name = None))
+
+    def analyze(self):
+        """Function to refresh the statistics of the indexes, once after the last load: without them SQLite picks
+        flows_product for the partner queries, which scans every product of the reporter."""
+        with self.connection() as con:
+            con.execute("ANALYZE")
+
+    def partners(self, reporter):
+        """Return the sorted partners of a reporter, country groups included."""
+        return [row[0] for row in self.connection().execute("SELECT DISTINCT partner FROM flows WHERE reporter = ? AND partner IS NOT NULL ORDER BY partner", (reporter,))]
+
+    def products(self, reporter, partners = None):
+        """Return the product codes (HS6 codes, chapters, industries and "total") traded by a reporter with some partners, or with all of them."""
+        sql, params = "SELECT DISTINCT product_code FROM flows WHERE reporter = ?", [reporter]
+        if partners is not None:
+            sql, params = sql + f" AND partner IN ({placeholders(partners)})", params + list(partners)
+        return [row[0] for row in self.connection().execute(sql, params)]
+
+    def flows(self, reporter, partners, product_code, years = None):
+        """Function to read the flows of a reporter with some partners in one product.
+
+        Args:
+            reporter (str): ISO3 code of the reporter.
+            partners (list): partner names.
+            product_code (str): HS6 code, chapter, industry or "total".
+            years (iterable, optional): years to read. Defaults to all.
+
+        Returns:
+            pd.DataFrame: the flows, sorted by trade flow, partner and year.
+        """
+        sql = f"SELECT {', '.join(COLUMNS)} FROM flows WHERE reporter = ? AND partner IN ({placeholders(partners)}) AND product_code = ?"
+        params = [reporter] + list(partners) + [product_code]
+        if years is not None:
+            years = [int(year) for year in years]
+            sql, params = sql + f" AND year IN ({placeholders(years)})", params + years
+        df = pd.read_sql_query(sql + " ORDER BY trade_flow, partner, year", self.connection(), params = params)
+        # A column of NULL (e.g. value_change of the first year) comes back as objects
+        return df.astype({col: 'float64' for col in NUMERIC_COLUMNS})
+
+    def nbytes(self):
+        return self.path.stat().st_size
+
+
+def build_query_store(reporter, years, work_path, output_path):
+    """Function to load the derived partitions of a reporter (the derived/ folder of an incremental update) into a store.
+
+    Returns:
+        QueryStore: the store.
+    """
+    store = QueryStore(output_path)
+    for year in years:
+        store.load(pd.read_csv(partition_path(Path(work_path) / 'derived', reporter, year), dtype = READ_DTYPES), reporter)
+    store.analyze()
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Load the derived partitions of a reporter into the query store.")
+    parser.add_argument('reporter', help = "ISO3 code of the reporter, e.g. KOR")
+    parser.add_argument('first_year', type = int)
+    parser.add_argument('last_year', type = int)
+    parser.add_argument('--work', type = Path, default = Path('temp/'))
+    parser.add_argument('--output', type = Path, default = Path('data/baci.sqlite'))
+    args = parser.parse_args()
+    build_query_store(args.reporter, range(args.first_year, args.last_year + 1), args.work, args.output)
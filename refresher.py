@@ -0,0 +1,90 @@
+"""Background refresh of the derived data while the app keeps serving.
+
+Refresher runs a job every interval seconds in a daemon thread and records how the last run went.
+Run as a script, it is the background worker of the data: every interval it brings the derived
+series and the served files of a reporter up to date with the BACI files (incremental.update), which
+publishes every file atomically. The app runs its own Refresher to swap in the datasets of the
+reporters whose files changed (ReporterRegistry.refresh).
+
+Usage: python refresher.py KOR 2007 2018 --input <BACI folder> --codes <country codes file> --work temp/ --served data/ --interval 3600
+"""
+import argparse
+import json
+import threading
+import time
+
+from pathlib import Path
+
+from utilities import logs
+
+
+class Refresher(threading.Thread):
+    """Daemon thread that calls job every interval seconds, the first time after one interval.
+
+    Args:
+        interval (float): seconds between the end of a run and the start of the next one.
+        job (function): called without arguments; its result is kept in the status.
+        name (str): name of the thread and of its log.
+    """
+
+    def __init__(self, interval, job, name = 'refresher'):
+        super().__init__(name = name, daemon = True)
+        self.interval = interval
+        self.job = job
+        self.stopped = threading.Event()
+        self.status = {'runs': 0, 'errors': 0, 'last_run': None, 'last_seconds': None, 'last_result': None, 'last_error': None}
+        # Opened when the thread starts or a run fails, so that an app with the refresh disabled writes no log file
+        self.log = None
+
+    def start(self):
+        self.log = logs(self.name, self.name)
+        super().start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """Run the job once in the calling thread; an error is logged and recorded, and the next runs go on."""
+        start = time.perf_counter()
+        try:
+            self.status['last_result'] = self.job()
+            self.status['last_error'] = None
+        except Exception as e:
+            self.status['errors'] += 1
+            self.status['last_error'] = repr(e)
+            self.log = self.log or logs(self.name, self.name)
+            self.log.exception("refresh failed")
+        self.status.update(runs = self.status['runs'] + 1, last_run = time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           last_seconds = time.perf_counter() - start)
+        return self.status
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    from incremental import update
+    parser = argparse.ArgumentParser(description = "Keep the derived series and the share files of a reporter up to date with the BACI files.")
+    parser.add_argument('reporter', help = "ISO3 code of the reporter, e.g. KOR")
+    parser.add_argument('first_year', type = int)
+    parser.add_argument('last_year', type = int)
+    parser.add_argument('--input', type = Path, required = True, help = "folder with the BACI yearly files")
+    parser.add_argument('--codes', type = Path, required = True, help = "BACI country codes file")
+    parser.add_argument('--work', type = Path, default = Path('temp/'))
+    parser.add_argument('--served', type = Path, default = Path('data/'))
+    parser.add_argument('--query', type = Path, help = "SQLite file of the query store to update")
+    parser.add_argument('--workers', type = int)
+    parser.add_argument('--interval', type = float, default = 3600, help = "seconds between two updates")
+    parser.add_argument('--once', action = 'store_true', help = "update once and exit")
+    args = parser.parse_args()
+
+    def job():
+        return update(range(args.first_year, args.last_year + 1), args.reporter, args.input, args.codes, args.work, args.served,
+                      workers = args.workers, query_path = args.query)
+    refresher = Refresher(args.interval, job)
+    while True:
+        status = refresher.run_once()
+        print(json.dumps(status, indent = 2, default = str))
+        if args.once or refresher.stopped.wait(args.interval):
+            break
@@ -0,0 +1,126 @@
+"""Registry of the reporters whose share files are in the data folder.
+
+A reporter is available when both <code>_import and <code>_export exist, as CSV files or in
+the columnar store. Its datasets and ranking index are loaded the first time it is requested,
+and the least recently used reporters are dropped once the loaded data exceeds the memory budget.
+refresh() swaps in the datasets of the reporters whose files were rewritten since they were loaded.
+"""
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+from plots_layout import ranking_index
+from trade_store import load_dataset
+
+REPORTER_NAMES = {'kor': 'Korean', 'mex': 'Mexican'}
+
+
+def reporter_name(reporter):
+    """Return the adjective used in the plot titles of a reporter, e.g. "Korean" for "kor"."""
+    return REPORTER_NAMES.get(reporter, reporter.upper())
+
+
+class ReporterRegistry():
+    """Lazily loaded share datasets of the reporters found in a data folder.
+
+    Args:
+        input_path (Path): folder with the share files.
+        industries (iterable): industries to rank, "Total" included.
+        memory_budget (int): bytes of loaded datasets above which the least recently used reporters are dropped.
+    """
+
+    def __init__(self, input_path, industries, memory_budget = 256 * 2**20):
+        self.input_path = Path(input_path)
+        self.industries = list(industries)
+        self.memory_budget = memory_budget
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.reporters = self.discover()
+
+    def discover(self):
+        """Return the codes of the reporters with both share files, from the file names only."""
+        names = {path.stem for path in self.input_path.glob('*_*.csv')}
+        names |= {path.parent.name for path in self.input_path.glob('store/*/meta.json')}
+        return sorted(name[:-len('_import')] for name in names if name.endswith('_import') and name[:-len('_import')] + '_export' in names)
+
+    def version(self, reporter):
+        """Return a string that changes when the share files of a reporter change, from their size and modification time."""
+        parts = []
+        for flow in ['import', 'export']:
+            for path in [self.input_path / f'{reporter}_{flow}.csv', self.input_path / 'store' / f'{reporter}_{flow}' / 'meta.json']:
+                if path.exists():
+                    stat = path.stat()
+                    parts.append(f'{stat.st_size}.{stat.st_mtime_ns}')
+        return '-'.join(parts)
+
+    def load(self, reporter):
+        """Function to load the datasets of a reporter and rank them, without adding them to the registry."""
+        version = self.version(reporter)
+        frames = {f'{reporter}_{flow}': load_dataset(f'{reporter}_{flow}', self.input_path) for flow in ['import', 'export']}
+        index = ranking_index(frames, self.industries)
+        nbytes = sum(df.memory_usage(deep = True).sum() for df in frames.values()) + sum(ranked['data'].memory_usage(deep = True).sum() for ranked in index.values())
+        return {'frames': frames, 'index': index, 'nbytes': int(nbytes), 'version': version}
+
+    def get(self, reporter):
+        """Function to return the datasets of a reporter, loading them on first use.
+
+        Returns:
+            dict: the datasets keyed by flow name ("kor_import", "kor_export") in "frames", their ranking index in
+            "index", their size in bytes in "nbytes" and the version of the files they were loaded from in "version".
+        """
+        if reporter not in self.reporters:
+            raise KeyError(f"no share files for reporter {reporter}")
+        with self.lock:
+            if reporter in self.loaded:
+                self.loaded.move_to_end(reporter)
+                return self.loaded[reporter]
+            loading = self.loading.setdefault(reporter, threading.Lock())
+        # A cold load only holds the lock of its reporter: the requests for the loaded reporters go on meanwhile,
+        # and the ones for the same reporter wait for this load instead of repeating it
+        with loading:
+            with self.lock:
+                if reporter in self.loaded:
+                    self.loaded.move_to_end(reporter)
+                    return self.loaded[reporter]
+            entry = self.load(reporter)
+            with self.lock:
+                self.loaded[reporter] = entry
+                while sum(loaded['nbytes'] for loaded in self.loaded.values()) > self.memory_budget and len(self.loaded) > 1:
+                    self.loaded.popitem(last = False)
+            return entry
+
+    def refresh(self):
+        """Function to find the reporters again and reload the loaded ones whose files changed.
+        The new datasets are loaded and ranked before the lock is taken, then swapped in at once: requests are
+        served from the previous datasets meanwhile, and never from a mix of both.
+
+        Returns:
+            list: the reporters reloaded.
+        """
+        reporters = self.discover()
+        with self.lock:
+            loaded = list(self.loaded.items())
+        fresh = {reporter: self.load(reporter) for reporter, entry in loaded if reporter in reporters and entry['version'] != self.version(reporter)}
+        with self.lock:
+            self.reporters = reporters
+            for reporter in list(self.loaded):
+                if reporter not in reporters:
+                    del self.loaded[reporter]
+                elif reporter in fresh:
+                    self.loaded[reporter] = fresh[reporter]
+        return sorted(fresh)
+
+    def select(self, reporters):
+        """Function to gather the datasets and ranking indexes of several reporters for layout_share.
+
+        Returns:
+            tuple: the datasets keyed by flow name and the merged ranking index.
+        """
+        frames, index = {}, {}
+        for reporter in reporters:
+            entry = self.get(reporter)
+            frames.update(entry['frames'])
+            index.update(entry['index'])
+        return frames, index
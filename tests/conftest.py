@@ -0,0 +1,59 @@
+import sys
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the app are top-level modules of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from class_data import BACI
+
+NAMES = ['Rep. of Korea', 'Mexico', 'USA', 'Canada', 'Japan'] + BACI.eu28
+ISO3 = ['KOR', 'MEX', 'USA', 'CAN', 'JPN'] + [f'E{position:02d}' for position in range(len(BACI.eu28))]
+
+
+def raw_year(year, n_rows = 5000, seed = 0):
+    """Return a small BACI yearly file (columns t, i, j, k, v, q) between the countries of country_codes."""
+    rng = np.random.default_rng(seed + year)
+    codes = np.arange(4, 4 + 4 * len(NAMES), 4)
+    positions = rng.integers(0, len(codes), n_rows)
+    chapters = rng.integers(1, 100, 50)
+    products = chapters * 10000 + rng.integers(0, 10000, 50)
+    return pd.DataFrame({'t': np.full(n_rows, year), 'i': codes[positions],
+                         'j': codes[(positions + rng.integers(1, len(codes), n_rows)) % len(codes)],
+                         'k': rng.choice(products, n_rows), 'v': rng.lognormal(3, 2, n_rows), 'q': rng.lognormal(2, 2, n_rows)})
+
+
+@pytest.fixture(scope = 'session')
+def country_codes():
+    codes = np.arange(4, 4 + 4 * len(NAMES), 4)
+    return pd.DataFrame({'country_code': [str(code) for code in codes], 'country_name_abbreviation': NAMES,
+                         'country_name_full': NAMES, 'iso_2digit_alpha': [iso3[:2] for iso3 in ISO3], 'iso_3digit_alpha': ISO3})
+
+
+def reporter_flows(reporter, country_codes, years = (2017, 2018)):
+    """Return the cleaned flows of a reporter, as the notebooks feed them to total_flow."""
+    parts = []
+    for year in years:
+        baci = BACI(raw_year(year), country_codes)
+        baci.adjust_columns()
+        baci.match_country_codes('origin')
+        baci.match_country_codes('destination')
+        baci.slice_countries('or', {'origin_iso3': reporter, 'destination_iso3': reporter})
+        baci.trade_flow_class({'origin_iso3': reporter, 'destination_iso3': reporter})
+        baci.industry_classification()
+        parts.append(baci.data)
+    return pd.concat(parts, ignore_index = True)
+
+
+@pytest.fixture(scope = 'session')
+def kor_flows(country_codes):
+    return reporter_flows('KOR', country_codes)
+
+
+@pytest.fixture(scope = 'session')
+def mex_flows(country_codes):
+    return reporter_flows('MEX', country_codes)
@@ -0,0 +1,147 @@
+"""total_flow and aggregate_countries give the same rows as the groupby and append code they replaced (tests/legacy.py),
+industry_classification the same industries as match_industry, the compact mode the same rows as the default one, and the
+reporter slice followed by the lookup tables the same rows as the merges with the country codes."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from class_data import BACI
+from conftest import raw_year
+from legacy import legacy_aggregate_country, legacy_total_flow
+
+GROUPS = {"EU28": (BACI.eu28, "0"), "EU27": (BACI.eu27, "1")}
+
+
+def assert_same_rows(left, right):
+    """The rows of a level are compared in key order: before pandas 1.3, groupby(observed = True) on the categorical
+    industry kept the groups in order of appearance."""
+    keys = ['year', 'trade_flow', 'origin_name', 'destination_name', 'product_code']
+    def ordered(df):
+        df = df.reset_index(drop = True)
+        return df.iloc[df.astype({key: str for key in keys}).sort_values(by = keys, kind = 'mergesort').index].reset_index(drop = True)
+    pd.testing.assert_frame_equal(ordered(left), ordered(right), check_dtype = False, check_categorical = False, rtol = 1e-9)
+
+
+def test_total_flow(kor_flows):
+    baci = BACI(kor_flows.copy(), pd.DataFrame())
+    baci.total_flow()
+    assert_same_rows(legacy_total_flow(kor_flows), baci.data)
+
+
+def test_total_flow_small_frame():
+    data = pd.DataFrame({'year': [2018, 2018, 2018, 2018], 'origin': ['4', '4', '8', '4'], 'destination': ['8', '8', '4', '8'],
+                         'origin_name': ['A', 'A', 'B', 'A'], 'destination_name': ['B', 'B', 'A', 'B'],
+                         'origin_iso3': ['AAA', 'AAA', 'BBB', 'AAA'], 'destination_iso3': ['BBB', 'BBB', 'AAA', 'BBB'],
+                         'product_code': ['010110', '020110', '010120', '870110'], 'value': [1.0, 2.0, 4.0, 8.0],
+                         'quantity': [1.0, 1.0, 1.0, 1.0], 'trade_flow': ['Export', 'Export', 'Import', 'Export'],
+                         'chapters': ['01', '02', '01', '87'], 'industry': ['Agri_Food', 'Agri_Food', 'Agri_Food', 'Vehicle']})
+    baci = BACI(data.copy(), pd.DataFrame())
+    baci.total_flow()
+    assert_same_rows(legacy_total_flow(data), baci.data)
+    totals = baci.data[baci.data['product_code'] == 'total']
+    assert sorted(totals['value']) == [4.0, 11.0]
+
+
+def test_aggregate_countries(kor_flows):
+    data = legacy_total_flow(kor_flows)
+    legacy = legacy_aggregate_country(legacy_aggregate_country(data, BACI.eu28, "EU28", "0"), BACI.eu27, "EU27", "1")
+    baci = BACI(data.copy(), pd.DataFrame())
+    baci.aggregate_countries(GROUPS)
+    assert_same_rows(legacy, baci.data)
+    one_by_one = BACI(data.copy(), pd.DataFrame())
+    one_by_one.aggregate_country(BACI.eu28, "EU28", "0")
+    one_by_one.aggregate_country(BACI.eu27, "EU27", "1")
+    assert_same_rows(legacy, one_by_one.data)
+
+
+def test_aggregate_countries_reporter_in_group():
+    """Mexico is in USMCA: only the rows whose partner is in the group are summed, not every row of the reporter."""
+    data = pd.DataFrame({'year': 2018, 'origin': ['484', '484', '124', '392'], 'destination': ['842', '392', '484', '484'],
+                         'origin_name': ['Mexico', 'Mexico', 'Canada', 'Japan'], 'destination_name': ['USA', 'Japan', 'Mexico', 'Mexico'],
+                         'origin_iso3': ['MEX', 'MEX', 'CAN', 'JPN'], 'destination_iso3': ['USA', 'JPN', 'MEX', 'MEX'],
+                         'product_code': '010110', 'value': [1.0, 2.0, 4.0, 8.0], 'quantity': [1.0, 1.0, 1.0, 1.0],
+                         'trade_flow': ['Export', 'Export', 'Import', 'Import']})
+    baci = BACI(data.copy(), pd.DataFrame())
+    baci.aggregate_countries({"USMCA": (BACI.usmca, "2")})
+    groups = baci.data.iloc[len(data):].set_index('trade_flow')
+    assert groups.loc['Export', 'value'] == 1.0 and groups.loc['Export', 'destination_name'] == 'USMCA' and groups.loc['Export', 'origin_name'] == 'Mexico'
+    assert groups.loc['Import', 'value'] == 4.0 and groups.loc['Import', 'origin_name'] == 'USMCA' and groups.loc['Import', 'destination_name'] == 'Mexico'
+
+
+def test_aggregate_countries_groups_in_one_pass(mex_flows):
+    """USMCA, a custom list and EU28 summed in one call, each on the partner side of the reporter."""
+    groups = {"USMCA": (BACI.usmca, "2"), "Custom": (["Japan", "Canada"], "3"), "EU28": (BACI.eu28, "0")}
+    baci = BACI(mex_flows.copy(), pd.DataFrame())
+    baci.aggregate_countries(groups)
+    added = baci.data.iloc[len(mex_flows):]
+    partner = mex_flows['origin_name'].where(mex_flows['trade_flow'] == 'Import', mex_flows['destination_name'])
+    for name, (countries, code) in groups.items():
+        expected = mex_flows[partner.isin(countries)].groupby(['year', 'product_code', 'trade_flow'])['value'].sum()
+        assert len(expected) > 0
+        rows = added[added['origin_name'].eq(name) | added['destination_name'].eq(name)]
+        assert (rows['origin'].eq(code) | rows['destination'].eq(code)).all()
+        pd.testing.assert_series_equal(rows.groupby(['year', 'product_code', 'trade_flow'])['value'].sum(), expected, check_names = False)
+
+
+def classify_rows(chapters, dictionary = None):
+    """Return the industries of industry_classification and of match_industry (row by row) for some chapters."""
+    codes = [f'{chapter:02d}0110' for chapter in chapters]
+    baci = BACI(pd.DataFrame({'product_code': codes}), pd.DataFrame())
+    baci.industry_classification(dictionary)
+    rows = pd.DataFrame({'chapters': chapters, 'industry': ''})
+    legacy = rows.apply(BACI.match_industry, dictionary = BACI.dict_industries if dictionary is None else dictionary, axis = 1)
+    return list(baci.data['industry'].astype(str)), list(legacy['industry'])
+
+
+def test_industry_classification():
+    lookup, legacy = classify_rows(list(range(1, 100)))
+    assert lookup == legacy
+
+
+def test_industry_classification_custom_map():
+    """Chapters outside every range get no industry, and on overlapping ranges the later one wins."""
+    dictionary = {"Food": [1, 24], "Drinks": [20, 22], "Metals": [72, 83]}
+    lookup, legacy = classify_rows([1, 19, 20, 22, 23, 50, 72, 83, 84], dictionary)
+    assert lookup == legacy
+    assert lookup == ['Food', 'Food', 'Drinks', 'Drinks', 'Food', '', 'Metals', 'Metals', '']
+
+
+def clean_year(country_codes, compact):
+    """Return the BACI of a small year after the cleaning steps of the notebooks, in the default or the compact mode."""
+    baci = BACI(raw_year(2018), country_codes, compact = compact)
+    baci.adjust_columns()
+    baci.match_country_codes('origin')
+    baci.match_country_codes('destination')
+    baci.trade_flow_class({'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+    baci.industry_classification()
+    return baci
+
+
+def test_compact_labels(country_codes):
+    """The compact mode keeps the same rows as the default one: labels() gives back the same labels, and values
+    equal to float32 precision."""
+    default, labeled = clean_year(country_codes, False).data, clean_year(country_codes, True).labels()
+    assert list(labeled.columns) == list(default.columns)
+    for col in default.columns:
+        if col in ['value', 'quantity']:
+            np.testing.assert_allclose(labeled[col], default[col], rtol = 1e-6)
+        else:
+            assert list(labeled[col].astype(str)) == list(default[col].astype(str)), col
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_slice_then_resolve(country_codes, compact):
+    """Slicing on the numeric codes of the reporter, then resolving the codes of the rows kept, gives the rows of the
+    two merges with the country codes followed by the slice, in the same order."""
+    merged = BACI(raw_year(2018), country_codes, compact = compact)
+    merged.adjust_columns()
+    merged.match_country_codes('origin')
+    merged.match_country_codes('destination')
+    merged.slice_countries('or', {'origin_iso3': 'KOR', 'destination_iso3': 'KOR'})
+    resolved = BACI(raw_year(2018), country_codes, compact = compact)
+    resolved.adjust_columns()
+    resolved.slice_reporter('KOR')
+    resolved.resolve_country_codes()
+    assert len(resolved.data) > 0
+    pd.testing.assert_frame_equal(merged.data.reset_index(drop = True), resolved.data.reset_index(drop = True),
+                                  check_dtype = False, check_categorical = False)
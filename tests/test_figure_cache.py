@@ -0,0 +1,37 @@
+"""The figure cache counters are kept by the backend: per process in memory, in the SQLite file for all the
+processes that share it."""
+import multiprocessing
+
+from figure_cache import DiskBackend, FigureCache, MemoryBackend
+
+
+def build(number):
+    return {'number': number}
+
+
+def fill(path):
+    cache = FigureCache(DiskBackend(path, 2**20))
+    for number in range(20):
+        cache.get_or_build((number % 5,), build)
+
+
+def test_memory_counters():
+    # Room for three figures of 13 bytes
+    cache = FigureCache(MemoryBackend(40))
+    for number in [1, 2, 1, 3, 4]:
+        cache.get_or_build((number,), build)
+    assert cache.stats() == {'hits': 1, 'misses': 4, 'evictions': 1, 'entries': 3, 'bytes': 39}
+
+
+def test_disk_counters_shared_by_processes(tmp_path):
+    path = tmp_path / 'figures.sqlite'
+    processes = [multiprocessing.Process(target = fill, args = (path,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+    stats = FigureCache(DiskBackend(path, 2**20)).stats()
+    assert stats['hits'] + stats['misses'] == 80
+    assert 5 <= stats['misses'] <= 20
+    assert stats['entries'] == 5
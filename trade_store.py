@@ -0,0 +1,164 @@
+"""Columnar, memory-mapped store for the trade share files served by the app.
+
+Each share file (e.g. data/mex_import.csv) becomes a folder of .npy columns:
+dictionary-encoded categoricals for the country and industry names, int16 years and
+float64 shares (float32 would merge close shares and change the dense rankings).
+The columns of every build go to a subfolder named after the source digest, and the
+build is published by atomically replacing meta.json. Loading maps the columns read-only,
+so every gunicorn worker shares the same pages through the OS cache instead of parsing
+its own copy of the CSV.
+Build or refresh the store with: python trade_store.py [data folder]
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utilities import logs
+
+CATEGORICAL_COLUMNS = ['origin_name', 'destination_name', 'industry']
+SHARE_COLUMNS = ['export_share', 'export_share_ind']
+EXCLUDED_PARTNERS = ['EU27']   # aggregates that are not plotted next to single countries
+
+
+def file_digest(path, block_size = 2**20):
+    """Return the sha1 hex digest of a file, read one block at a time."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def drop_excluded(df):
+    return df[~(df['origin_name'].isin(EXCLUDED_PARTNERS) | df['destination_name'].isin(EXCLUDED_PARTNERS))]
+
+
+def build_dataset(csv_file, output_path):
+    """Function to convert one share CSV file into a folder of .npy columns.
+
+    Args:
+        csv_file (Path): share file with year, origin_name, destination_name, industry and the share columns.
+        output_path (Path): root folder of the store; the columns are written to output_path / csv_file.stem.
+    """
+    folder = Path(output_path) / Path(csv_file).stem
+    digest = file_digest(csv_file)
+    # Every version of the columns gets its own folder, published by replacing meta.json: readers, and the
+    # columns they have mapped, never see a version half written
+    version = folder / digest[:16]
+    previous = read_meta(folder).get('version')
+    if previous == version.name and version.exists():
+        return   # up to date; rewriting would truncate columns mapped by the readers
+    if not version.exists():
+        # The columns are written to a folder of this process and renamed into place, so that the workers
+        # building the store at the same time never write to the same files
+        building = folder / f'.{version.name}.{os.getpid()}'
+        building.mkdir(parents = True, exist_ok = True)
+        df = drop_excluded(pd.read_csv(csv_file))
+        meta = {'rows': len(df), 'columns': list(df.columns), 'source_digest': digest, 'version': version.name, 'categories': {}}
+        np.save(building / 'year.npy', df['year'].to_numpy(dtype = 'int16'))
+        # Shares are saved column-major, so the loaded array is used as the dataframe block as it is
+        np.save(building / 'shares.npy', np.ascontiguousarray(df[SHARE_COLUMNS].to_numpy(dtype = 'float64').T))
+        for col in CATEGORICAL_COLUMNS:
+            values = df[col].astype('category')
+            np.save(building / f'{col}.npy', values.cat.codes.to_numpy())
+            meta['categories'][col] = [str(x) for x in values.cat.categories]
+        with open(building / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(building, version)
+        except OSError:   # built by another process meanwhile
+            shutil.rmtree(building, ignore_errors = True)
+    temp_file = folder / f'meta.{os.getpid()}.tmp'
+    shutil.copyfile(version / 'meta.json', temp_file)
+    os.replace(temp_file, folder / 'meta.json')
+    # Keep the previous version for the readers that loaded its meta.json just before the swap
+    for path in folder.iterdir():
+        if path.is_dir() and path.name not in [version.name, previous] and not path.name.startswith('.'):
+            shutil.rmtree(path, ignore_errors = True)
+
+
+def read_meta(folder):
+    try:
+        with open(Path(folder) / 'meta.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_store(input_path, output_path = None):
+    """Function to convert every *_import.csv and *_export.csv file in input_path into the columnar store.
+
+    Args:
+        input_path (Path): folder with the share files.
+        output_path (Path, optional): root folder of the store. Defaults to input_path / "store".
+    """
+    input_path = Path(input_path)
+    output_path = input_path / 'store' if output_path is None else Path(output_path)
+    for csv_file in sorted(input_path.glob('*_import.csv')) + sorted(input_path.glob('*_export.csv')):
+        build_dataset(csv_file, output_path)
+
+
+def read_dataset(folder, mmap = True):
+    """Function to load one dataset of the store.
+
+    Args:
+        folder (Path): folder written by build_dataset.
+        mmap (bool): memory-map the columns read-only instead of reading them in memory.
+
+    Returns:
+        pd.DataFrame: the dataset, with the columns in the order of the source file.
+    """
+    folder = Path(folder)
+    mode = 'r' if mmap else None
+    with open(folder / 'meta.json') as f:
+        meta = json.load(f)
+    columns_folder = folder / meta['version']
+    shares = np.load(columns_folder / 'shares.npy', mmap_mode = mode)
+    df = pd.DataFrame(shares.T, columns = SHARE_COLUMNS, copy = False)
+    columns = {'year': np.load(columns_folder / 'year.npy', mmap_mode = mode)}
+    for col in CATEGORICAL_COLUMNS:
+        columns[col] = pd.Categorical.from_codes(np.load(columns_folder / f'{col}.npy', mmap_mode = mode), categories = meta['categories'][col])
+    # Insert in place, in the order of the source file: selecting columns would copy the mapped block
+    for position, col in enumerate(meta['columns']):
+        if col in columns:
+            df.insert(position, col, columns[col])
+    return df
+
+
+def load_dataset(name, input_path, store_path = None, mmap = True):
+    """Function to load a share dataset, from the columnar store when it is present and up to date,
+    otherwise from the CSV file. Aggregates in EXCLUDED_PARTNERS are dropped in both cases.
+
+    Args:
+        name (str): name of the share file without extension, e.g. "mex_import".
+        input_path (Path): folder with the share files.
+        store_path (Path, optional): root folder of the store. Defaults to input_path / "store".
+        mmap (bool): memory-map the store columns.
+
+    Returns:
+        pd.DataFrame: the share dataset.
+    """
+    input_path = Path(input_path)
+    folder = (input_path / 'store' if store_path is None else Path(store_path)) / name
+    csv_file = input_path / f'{name}.csv'
+    try:
+        with open(folder / 'meta.json') as f:
+            digest = json.load(f)['source_digest']
+        if not csv_file.exists() or digest == file_digest(csv_file):
+            return read_dataset(folder, mmap = mmap)
+        reason = "the store is older than the CSV file"
+    except (OSError, ValueError, KeyError) as e:
+        reason = f"the store cannot be read ({e!r})"
+    logs('trade_store', 'trade_store').warning(f"{name} read from {csv_file} in every process instead of being mapped from the store: {reason}")
+    return drop_excluded(pd.read_csv(csv_file))
+
+
+if __name__ == '__main__':
+    build_store(Path(sys.argv[1]) if len(sys.argv) > 1 else Path('data/'))
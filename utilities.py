@@ -1,13 +1,26 @@
 import logging
+import os
 
 from pathlib import Path
 
 def logs(file_name, logger_name):
     logs_folder = Path("logs")   # Create Path object to folder with logs
+    logs_folder.mkdir(exist_ok = True)
     logger = logging.getLogger(f"{logger_name}")   # Add logger
+    log_file = (logs_folder / f'{file_name}.log').resolve()
+    # Loggers are global: reuse the handler of a previous call instead of opening the file once more
+    if any(isinstance(handler, logging.FileHandler) and Path(handler.baseFilename) == log_file for handler in logger.handlers):
+        return logger
     formatter = logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")    # Formatting for the log message
-    fileHandler = logging.FileHandler(logs_folder / f'{file_name}.log', mode='a')     # File to use as log
+    fileHandler = logging.FileHandler(log_file, mode='a')     # File to use as log
     fileHandler.setFormatter(formatter)     # Set for that file the formatting of the messages
     logger.setLevel(logging.INFO)   # Use info as level for the log
     logger.addHandler(fileHandler)  # Add handler to the logger
     return logger
+
+def replace_csv(df, file):
+    """Write a dataframe to a CSV file through a temporary file, so readers never see it half written."""
+    file = Path(file)
+    temp_file = file.with_suffix('.tmp')
+    df.to_csv(temp_file, index = False)
+    os.replace(temp_file, file)